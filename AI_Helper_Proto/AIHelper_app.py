@@ -1,165 +1,217 @@
 import os
-import tools
-import chromadb
-import json
-import google.generativeai as genai
+import uuid
 import streamlit as st
 
-from typing import List
-from sentence_transformers import CrossEncoder
-from sentence_transformers import SentenceTransformer
+import answer_cache
+import chat_store
+import context
+import crop_engine
+import crop_query
+import knowledge_base
+import lexical_index
+import model_registry
+import pipeline
+import tools
+import tracing
+import warmup
+
+from concurrent.futures import ThreadPoolExecutor
 
 # ---配置加载模型和数据库---
-# 配置GeminiAPIKey
+# GeminiAPIKey，在后台预热时配置
 API_KEY = os.environ.get("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
 
 
-# 配置加载Embedding和Cross-Encoder模型
+# 配置加载Embedding和Cross-Encoder模型，以及其前面的提问向量缓存和重排打分缓存
+# 模型由进程级注册表统一加载，通过cache_resource在所有会话间共享
 @st.cache_resource
 def load_models():
-    embedding_model = SentenceTransformer("shibing624/text2vec-base-chinese")
-    cross_encoder = CrossEncoder('cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
-    return embedding_model, cross_encoder
+    query_cache = model_registry.get_query_cache()
+    cross_encoder = model_registry.get_cross_encoder()
+    score_cache = model_registry.get_score_cache()
+    return query_cache, cross_encoder, score_cache
+
+
+# 连接向量知识库，后端由knowledge_base.VECTOR_BACKEND决定
+@st.cache_resource
+def load_vector_store():
+    return knowledge_base.get_store()
 
 
-# 连接向量数据库
+# 语义回答缓存，复用提问向量缓存；作物数据库或向量知识库变化时失效
 @st.cache_resource
-def load_chromadb():
-    chromadb_client = chromadb.PersistentClient("zuowu.db")
-    return chromadb_client.get_or_create_collection(name="default")
+def load_answer_cache(_query_cache, _store):
+    source_paths = [crop_query.DB_PATH, *_store.data_files()]
+    return answer_cache.SemanticAnswerCache(_query_cache, source_paths)
 
 
-# ---召回和重排方法---
-def retrieve_and_rerank(query: str, top_k1=10, top_k2=4):
-    # 获取提问向量值
-    query_embedding = embedding.encode(query).tolist()
+# 知识库片段的BM25关键词索引；以向量库文件指纹作为缓存键，知识库重建后自动重新构建
+@st.cache_resource
+def load_lexical_index(_store, fingerprint):
+    return lexical_index.LexicalIndex.from_store(_store)
 
-    # 召回过程，粗略进行数据库向量匹配
-    retrieved_info = chromadb_collection.query(query_embeddings=query_embedding, n_results=top_k1)
-    retrieved = retrieved_info['documents'][0]
 
-    # 重排过程，对召回片段逐一进行比较打分
-    pairs = [(query, chunk) for chunk in retrieved]
-    scores = cross_encoder.predict(pairs)
+# 上下文整理器，其句子向量缓存在所有会话和提问间共享
+@st.cache_resource
+def load_context_builder(_query_cache):
+    return context.ContextBuilder(_query_cache, model_registry.get_tokenizer())
 
-    chunk_with_scores = [(chunk, score) for chunk, score in zip(retrieved, scores)]
-    chunk_with_scores.sort(key=lambda pair: pair[1], reverse=True)
 
-    return [chunk for chunk, _ in chunk_with_scores[:top_k2]]
+# 对模型和知识库各做一次推理，使首次推理的初始化开销发生在预热阶段
+def warm_inference() -> None:
+    model_registry.get_embedding_model().encode("预热")
+    model_registry.get_cross_encoder().predict([("预热", "预热")])
 
 
-# ---函数调用---
-def call_tool(tool_call):
-    function_name = tool_call.name
-    args = {k: v for k, v in tool_call.args.items()}
+# 后台预热，每个进程只启动一次：模型、向量库和作物数据在后台线程中加载，界面和历史消息先行渲染
+# 这里直接调用进程级的加载函数，不调用cache_resource函数，上面的load_*在预热完成后几乎不再耗时
+@st.cache_resource
+def load_warmup():
+    steps = [
+        ("genai", lambda: pipeline.configure_genai(API_KEY)),
+        ("vector_store", knowledge_base.get_store),
+        ("embedding_model", model_registry.get_query_cache),
+        ("cross_encoder", model_registry.get_cross_encoder),
+        ("tokenizer", model_registry.get_tokenizer),
+        ("warm_inference", warm_inference),
+    ]
+    if tools.CROP_BACKEND == "memory":
+        steps.append(("crop_engine", crop_engine.get_engine))
+    return warmup.Warmup(steps).start()
 
-    # 函数名到实际函数的映射
-    available_functions = {
-        "get_crops_by_sellprice": tools.get_crops_by_sellprice,
-        "get_crops_by_dailyrevenue": tools.get_crops_by_dailyrevenue,
-        "get_crops_by_seedprice": tools.get_crops_by_seedprice,
-        "get_crops_by_growtime": tools.get_crops_by_growtime,
-    }
 
-    if function_name in available_functions:
-        return available_functions[function_name](**args)
+# ---回答流程---
+# 是否使用向量+关键词的混合召回
+HYBRID_RETRIEVAL = True
+# 是否以流式方式逐段渲染回答
+STREAM_ANSWER = True
+# 是否在侧边栏显示上一次回答各阶段的耗时
+SHOW_TRACE_SIDEBAR = True
+# Prometheus指标接口端口，为None时只写入tracing.METRICS_PATH指标文件
+METRICS_PORT = None
 
 
-# ---回答方法---
-def generate_answer(query: str):
-    prompt = f"""你是一位星露谷农作物种植助手，请根据用户问题和提供片段中的有用信息生成准确回答。回答格式请尽量简洁，美观。
-    不要编造信息，请从工具库中选择合适的工具来获取信息。若无需其他信息，则直接回答。若所获信息无法解决问题，则直接说明无法解决。"""
+# 工具线程池，通过cache_resource在所有会话间共享
+@st.cache_resource
+def load_tool_executor():
+    return ThreadPoolExecutor(max_workers=pipeline.TOOL_WORKERS, thread_name_prefix="tool")
 
-    # 构造第一轮消息
-    messages = [
-        {"role": "user", "parts": [{"text": prompt}]},
-        {"role": "user", "parts": [{"text": f"用户问题: {query}\n\n"}]}
-    ]
 
-    # 获取响应
-    model = genai.GenerativeModel("gemini-2.5-flash", tools=tools.TOOLS_LIST)
-    response = model.generate_content(messages)
+# RAG预取线程池，与工具线程池分开，避免工具线程等待排在自己后面的预取任务
+@st.cache_resource
+def load_prefetch_executor():
+    return ThreadPoolExecutor(max_workers=pipeline.PREFETCH_WORKERS, thread_name_prefix="rag-prefetch")
+
 
-    # 检查响应是否包含函数调用
+# 指标接口在进程内只启动一次
+@st.cache_resource
+def load_metrics_server(port: int):
+    return tracing.start_metrics_server(port)
+
+
+# 在侧边栏显示启动过程中各步骤的时间线
+def render_startup_sidebar(timeline) -> None:
+    with st.sidebar.expander("启动耗时"):
+        st.dataframe([
+            {"步骤": entry["step"], "开始(ms)": round(entry["start_ms"]), "耗时(ms)": round(entry["duration_ms"])}
+            for entry in timeline
+        ], hide_index=True)
+
+
+# 在侧边栏按调用层级显示一次回答的各阶段耗时
+def render_trace_sidebar(trace_id: str) -> None:
+    records = tracing.get_trace(trace_id)
+    if not records:
+        return
+    parents = {record["span_id"]: record["parent_id"] for record in records}
+
+    def depth(record) -> int:
+        level, parent = 0, record["parent_id"]
+        while parent in parents:
+            level, parent = level + 1, parents[parent]
+        return level
+
+    st.sidebar.subheader("上次回答耗时")
+    st.sidebar.dataframe([
+        {"阶段": "· " * depth(record) + record["name"], "耗时(ms)": round(record["duration_ms"], 1)}
+        for record in records
+    ], hide_index=True)
+
+    # 本次回答的token数
+    root = next((record for record in records if record["parent_id"] is None), None)
+    if root is not None and "prompt_tokens" in root["attributes"]:
+        attributes = root["attributes"]
+        caption = f"提问{attributes['prompt_tokens']} token，回答{attributes.get('response_tokens', 0)} token"
+        if "context_tokens" in attributes:
+            caption += f"，RAG上下文{attributes['context_tokens_raw']} → {attributes['context_tokens']} token"
+        st.sidebar.caption(caption)
+
+
+# 等待预热完成后组装回答流程；回答流程对象很轻，每次提问时用共享的模型、索引、线程池和上下文整理器重新组装
+def get_answer_pipeline() -> pipeline.AnswerPipeline:
     try:
-        tool_call = response.candidates[0].content.parts[0].function_call
-
-        # 若为函数调用
-        if tool_call:
-            print("get function calling\n")
-
-            # 若为RAG检索请求
-            if tool_call.name == "RAGCalling":
-                print("RAG Search\n")
-
-                # 执行召回、重排过程
-                retrieved_chunks = retrieve_and_rerank(user_query)
-                messages.append({"role": "user", "parts": [{"text": f"可用片段如下:{retrieved_chunks}"}]})
-
-                print("生成回答，相关分片为:\n")
-                i = 0
-                for chunk in retrieved_chunks:
-                    print(f"分片{i}:{chunk}\n")
-                    i += 1
-
-                # 根据RAG片段生成最终回答
-                final_response = model.generate_content(messages)
-                return final_response.text
-
-            # 若为正常函数调用
-            else:
-                print("Function Search\n")
-
-                # 执行函数并获取结果
-                tool_output = call_tool(tool_call)
-
-                # 构造函数响应消息格式
-                function_response_part = {
-                    "function_response": {
-                        "name": tool_call.name,
-                        "response": {
-                            "content": tool_output
-                        }
-                    }
-                }
-                messages.append({"role": "function", "parts": [function_response_part]})
-
-                # 将函数结果传给模型生成最终回答
-                final_response = model.generate_content(messages)
-                return final_response.text
-
-        # 若无需额外信息来源
+        if not startup.ready():
+            with st.spinner("正在加载Embedding和Cross-Encoder模型并连接知识库..."):
+                startup.wait()
         else:
-            # 直接返回回答
-            print(response.text)
-            return response.text
-    except (AttributeError, IndexError):
-        if response.text:
-            return response.text
+            startup.wait()
+    except Exception as e:
+        # 清除失败的预热，下次提问时重新预热
+        load_warmup.clear()
+        st.error(f"模型或知识库加载失败: {e}")
+        st.stop()
+    query_cache, cross_encoder, score_cache = load_models()
+    store = load_vector_store()
+    answers = load_answer_cache(query_cache, store)
+    keyword_index = (load_lexical_index(store, answer_cache.data_fingerprint(store.data_files()))
+                     if HYBRID_RETRIEVAL else None)
+    return pipeline.AnswerPipeline(store, query_cache, cross_encoder, score_cache,
+                                   keyword_index, answers, tool_executor=load_tool_executor(),
+                                   prefetch_executor=load_prefetch_executor(),
+                                   context_builder=load_context_builder(query_cache))
 
 
 # ---消息持久化---
-CHAT_HISTORY = "chat_history.json"
+# 聊天视图首次显示的消息条数，更早的消息按页加载
+HISTORY_PAGE_SIZE = 20
+# 每个会话在session_state中最多保留的消息数，超出的旧消息需要时再从存储中加载
+MAX_MESSAGES_IN_MEMORY = 100
+# 聊天记录后端："sqlite"为按会话保存的SQLite（WAL），"jsonl"为按会话分文件的JSONL
+CHAT_BACKEND = "sqlite"
+
+
+# 聊天记录存储，所有会话共享
+@st.cache_resource
+def load_chat_store():
+    if CHAT_BACKEND == "jsonl":
+        return chat_store.JsonlSessionStore()
+    return chat_store.SqliteChatStore()
 
 
-# 历史消息加载方法
-def load_chat_history():
-    if os.path.exists(CHAT_HISTORY):
-        with open(CHAT_HISTORY, "r") as file:
-            return json.load(file)
-    return []
+# 当前会话id：优先取链接中的sid参数，使刷新页面后仍能找回记录；否则新建
+def get_session_id() -> str:
+    if "session_id" not in st.session_state:
+        session_id = st.query_params.get("sid")
+        if not chat_store.is_valid_session_id(session_id):
+            session_id = uuid.uuid4().hex
+            st.query_params["sid"] = session_id
+        st.session_state.session_id = session_id
+    return st.session_state.session_id
 
 
-# 历史消息保存方法
-def save_chat_history(messages):
-    with open(CHAT_HISTORY, "w") as file:
-        json.dump(messages, file, ensure_ascii=False, indent=4)
+# 限制session_state中保存的消息数，丢弃的旧消息从其游标处重新分页加载
+def trim_messages() -> None:
+    messages = st.session_state.messages
+    if len(messages) > MAX_MESSAGES_IN_MEMORY:
+        st.session_state.messages = messages[-MAX_MESSAGES_IN_MEMORY:]
+        st.session_state.history_offset = st.session_state.messages[0]["cursor"]
 
 
 # ---UI界面---
 st.set_page_config(page_title="星露谷物语小助手", page_icon="🌱")
+startup = load_warmup()
 st.title("🌱星露谷物语农作物小助手")
+chat_history = load_chat_store().session(get_session_id())
 col1, col2 = st.columns([4,1])
 with col1:
     st.markdown("输入你的农作物相关问题，我将根据本地知识库为你提供准确的攻略信息。")
@@ -168,31 +220,47 @@ with col2:
     # 添加清空历史的按钮
     if st.button("清空历史消息"):
         st.session_state.messages = []
-        save_chat_history([])
+        st.session_state.history_offset = 0
+        chat_history.clear()
         st.rerun()
 
-# 初始化模型并连接知识库
-with st.spinner("正在加载Embedding和Cross-Encoder模型..."):
-    embedding, cross_encoder = load_models()
-
-with st.spinner("正在连接知识库..."):
-    chromadb_collection = load_chromadb()
+if METRICS_PORT is not None:
+    load_metrics_server(METRICS_PORT)
 
 # ---页面会话逻辑---
-# 初始化会话状态中的聊天记录
+# 初始化会话状态中的聊天记录，只加载最近的一页
 if "messages" not in st.session_state:
     with st.spinner("正在加载历史消息..."):
-        st.session_state.messages = load_chat_history()
+        st.session_state.messages, st.session_state.history_offset = chat_history.load_recent(HISTORY_PAGE_SIZE)
+
+# 旧版历史文件已迁移为单独的会话，新会话中给出打开它的链接
+if (not st.session_state.messages and get_session_id() != chat_store.LEGACY_SESSION_ID
+        and load_chat_store().session(chat_store.LEGACY_SESSION_ID).load_recent(1)[0]):
+    st.info(f"旧版聊天记录已迁移，可在[这里](?sid={chat_store.LEGACY_SESSION_ID})查看。")
+
+# 按需加载更早的消息，已加载的消息数不超过MAX_MESSAGES_IN_MEMORY
+if st.session_state.history_offset > 0:
+    room = MAX_MESSAGES_IN_MEMORY - len(st.session_state.messages)
+    if room <= 0:
+        st.caption(f"最多显示最近{MAX_MESSAGES_IN_MEMORY}条消息")
+    elif st.button("加载更早的消息"):
+        older, st.session_state.history_offset = chat_history.read_before(st.session_state.history_offset,
+                                                                          min(HISTORY_PAGE_SIZE, room))
+        st.session_state.messages = older + st.session_state.messages
+        st.rerun()
 
-# 遍历并显示历史消息
+# 遍历并显示已加载的历史消息
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+startup.mark("first_paint")
 
 # 监听用户输入
 if user_query := st.chat_input("在这里输入你的问题..."):
-    # 在会话中添加新用户消息
-    st.session_state.messages.append({"role": "user", "content": user_query})
+    # 在会话中添加新用户消息，并立即追加保存
+    user_message = {"role": "user", "content": user_query}
+    user_message["cursor"] = chat_history.append(user_message)
+    st.session_state.messages.append(user_message)
 
     # 渲染新用户消息
     with st.chat_message("user"):
@@ -200,18 +268,31 @@ if user_query := st.chat_input("在这里输入你的问题..."):
 
     # 渲染助手消息
     with st.chat_message("assistant"):
-        with st.spinner("正在搜索和生成回答..."):
-            # 调用回答方法
-            answer = generate_answer(user_query)
-
-            # 将回答保存到会话
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": answer,
-            })
-
-            # 立即保存
-            save_chat_history(st.session_state.messages)
-
+        # 预热未完成时在这里等待
+        answer_pipeline = get_answer_pipeline()
+        stats = {}
+        if STREAM_ANSWER:
+            # 边生成边渲染到当前气泡中，完成后无需整页重跑
+            answer = st.write_stream(answer_pipeline.generate_answer_stream(user_query, stats))
+        else:
+            with st.spinner("正在搜索和生成回答..."):
+                # 调用回答方法
+                answer = answer_pipeline.generate_answer(user_query, stats)
+
+        # 将回答保存到会话，并立即追加保存
+        assistant_message = {
+            "role": "assistant",
+            "content": answer,
+        }
+        assistant_message["cursor"] = chat_history.append(assistant_message)
+        st.session_state.messages.append(assistant_message)
+        trim_messages()
+        st.session_state.last_trace_id = stats.get("trace_id")
+
+    if not STREAM_ANSWER:
         st.rerun()
 
+if SHOW_TRACE_SIDEBAR and st.session_state.get("last_trace_id"):
+    render_trace_sidebar(st.session_state.last_trace_id)
+if SHOW_TRACE_SIDEBAR and startup.ready() and startup.future.exception() is None:
+    render_startup_sidebar(startup.timeline)
@@ -0,0 +1,206 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import caches
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(BASE_DIR, "answer_cache")
+
+# 命中所需的最低余弦相似度
+SIMILARITY_THRESHOLD = 0.95
+# 缓存条目的有效期（秒）
+ANSWER_TTL = 7 * 24 * 3600
+# 缓存条目上限，超出时淘汰最久未使用的条目
+ANSWER_CACHE_SIZE = 1000
+# 条目变化后延迟写盘的时间（秒），期间的多次变化合并为一次写入
+SAVE_DELAY = 2.0
+# 含有这些说法的回答（无法作答、出错）不缓存，下次提问时重新回答
+UNCACHEABLE_PHRASES = ("无法解决", "无法回答", "无法确定", "无法提供", "无法获取", "没有找到", "出错", "抱歉")
+# 提问中的季节和数字：向量相似度对"春季最赚钱"和"夏季最赚钱"这类只差一个字的提问区分不开，
+# 两个提问的这些词不同时不视为同一问题
+_DISTINGUISHING_PATTERN = re.compile(r"[春夏秋冬]|\d+(?:\.\d+)?")
+
+
+def distinguishing_terms(query: str) -> List[str]:
+    return sorted(set(_DISTINGUISHING_PATTERN.findall(query)))
+
+
+def is_cacheable_answer(answer: str) -> bool:
+    return bool(answer) and not any(phrase in answer for phrase in UNCACHEABLE_PHRASES)
+
+
+# 知识来源文件的指纹（修改时间和大小），任一文件变化时缓存整体失效
+def data_fingerprint(paths: Sequence[str]) -> List[Tuple[str, int, int]]:
+    fingerprint = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return fingerprint
+
+
+# 语义回答缓存：以提问向量为键，相似度超过阈值且季节、数字相同时直接返回已保存的回答；
+# 同时受TTL和LRU容量限制，持久化到本地磁盘，重启后仍然有效。
+# 写盘由后台定时器在条目变化SAVE_DELAY秒后进行，不占用查询的锁；进程退出时写入尚未保存的变化
+class SemanticAnswerCache:
+    def __init__(self, embedding_model, source_paths: Sequence[str], path: str = CACHE_PATH,
+                 threshold: float = SIMILARITY_THRESHOLD, ttl: float = ANSWER_TTL,
+                 maxsize: int = ANSWER_CACHE_SIZE, save_delay: float = SAVE_DELAY):
+        self.embedding_model = embedding_model
+        self.source_paths = list(source_paths)
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 归一化提问 -> {"query", "answer", "created_at", "embedding"}
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        self._fingerprint = data_fingerprint(self.source_paths)
+        self._save_timer: Optional[threading.Timer] = None
+        self._save_lock = threading.Lock()
+        self._load()
+        atexit.register(self.flush)
+
+    def _embed(self, query: str) -> np.ndarray:
+        embedding = np.asarray(self.embedding_model.encode(query), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    # 数据库或向量知识库变化后清空缓存
+    def _check_fingerprint(self) -> None:
+        fingerprint = data_fingerprint(self.source_paths)
+        if fingerprint != self._fingerprint:
+            self._entries.clear()
+            self._matrix = None
+            self._fingerprint = fingerprint
+            self._schedule_save()
+
+    def _expire(self) -> None:
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    # 所有条目的向量矩阵，条目变化后重建
+    def _get_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = (np.stack([self._entries[key]["embedding"] for key in self._keys])
+                            if self._keys else np.zeros((0, 0), dtype=np.float32))
+        return self._matrix
+
+    def lookup(self, query: str) -> Optional[str]:
+        embedding = self._embed(caches.normalize_query(query))
+        with self._lock:
+            self._check_fingerprint()
+            self._expire()
+            matrix = self._get_matrix()
+            if len(self._keys):
+                similarities = matrix @ embedding
+                terms = distinguishing_terms(caches.normalize_query(query))
+                for best in np.argsort(-similarities, kind="stable"):
+                    if similarities[best] < self.threshold:
+                        break
+                    key = self._keys[best]
+                    if distinguishing_terms(key) == terms:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return self._entries[key]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, query: str, answer: str) -> None:
+        if not is_cacheable_answer(answer):
+            return
+        key = caches.normalize_query(query)
+        embedding = self._embed(key)
+        with self._lock:
+            self._check_fingerprint()
+            self._entries[key] = {"query": query, "answer": answer, "created_at": time.time(), "embedding": embedding}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._schedule_save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._schedule_save()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    # 调用前需持有self._lock；已有定时器时不重复创建
+    def _schedule_save(self) -> None:
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    # 立即写入尚未保存的变化；写文件时不持有查询的锁，_save_lock保证先取的快照先写入
+    def flush(self) -> None:
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is None:
+                    return
+                self._save_timer.cancel()
+                self._save_timer = None
+                keys = list(self._entries)
+                meta = {
+                    "fingerprint": self._fingerprint,
+                    "entries": [{key: value for key, value in self._entries[k].items() if key != "embedding"}
+                                for k in keys],
+                }
+                embeddings = (np.stack([self._entries[k]["embedding"] for k in keys])
+                              if keys else np.zeros((0, 0), dtype=np.float32))
+            self._save(meta, embeddings)
+
+    # 元数据写入json，向量写入npy；先写临时文件再替换，避免写到一半崩溃损坏缓存
+    def _save(self, meta: Dict, embeddings: np.ndarray) -> None:
+        with open(self.path + ".npy.tmp", "wb") as file:
+            np.save(file, embeddings)
+        with open(self.path + ".json.tmp", "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(self.path + ".npy.tmp", self.path + ".npy")
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def _load(self) -> None:
+        try:
+            with open(self.path + ".json", "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            embeddings = np.load(self.path + ".npy")
+        except (OSError, ValueError):
+            return
+        # 缓存写入后知识来源已变化，或两个文件不一致时丢弃
+        if [tuple(item) for item in meta["fingerprint"]] != self._fingerprint:
+            return
+        if len(meta["entries"]) != len(embeddings):
+            return
+        for entry, embedding in zip(meta["entries"], embeddings):
+            self._entries[caches.normalize_query(entry["query"])] = {**entry, "embedding": embedding}
+        self._expire()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Set
+
+import caches
+import knowledge_base
+import lexical_index
+import llm_client
+import model_registry
+import pipeline
+import retrieval
+import tools
+import tracing
+
+# 同时进行的回答数
+BATCH_CONCURRENCY = 4
+# 每分钟最多发出的模型请求数，为0时不限速
+REQUESTS_PER_MINUTE = 60
+# 模型请求遇到临时性错误后的重试次数，以及退避等待的基数（秒）；重试由llm_client.LLMClient完成，每次重试同样经过限速
+MAX_RETRIES = 3
+RETRY_BACKOFF = 2.0
+
+
+# 限速器：相邻两次请求至少间隔60/requests_per_minute秒，多个线程按到达顺序依次放行
+class RateLimiter:
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+# 每次调用模型前先经过限速器，其余属性原样转发
+class RateLimitedModel:
+    def __init__(self, model, limiter: RateLimiter):
+        self._model = model
+        self._limiter = limiter
+
+    def generate_content(self, *args, **kwargs):
+        self._limiter.acquire()
+        return self._model.generate_content(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+# 批量编码好的提问向量，接口与embedding模型的encode一致
+class PrecomputedEmbeddings:
+    def __init__(self, queries: List[str], embeddings):
+        self._embeddings = dict(zip(queries, embeddings))
+
+    def encode(self, query: str):
+        return self._embeddings[query]
+
+
+# 问题id：输入中给出时使用，否则取归一化问题的哈希，重复的问题只回答一次
+def question_id(question: str) -> str:
+    return caches.text_hash(caches.normalize_query(question))[:16]
+
+
+# 读取问题文件：.jsonl每行为{"question": ..., "id": 可选}，其他文件每行一个问题
+def load_questions(path: str) -> List[Dict[str, str]]:
+    items = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                question = record["question"]
+                item_id = str(record.get("id") or question_id(question))
+            else:
+                question, item_id = line, question_id(line)
+            items.setdefault(item_id, {"id": item_id, "question": question})
+    return list(items.values())
+
+
+# 已成功回答的问题id；上次写入中途崩溃时最后一行不完整，补上换行使其成为独立的损坏行并跳过
+def load_finished(path: str) -> Set[str]:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return set()
+    with open(path, "rb+") as file:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b"\n":
+            file.write(b"\n")
+
+    finished = set()
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in record:
+                finished.add(record["id"])
+    return finished
+
+
+# 为全部问题一次性完成召回和重排：所有提问一次批量编码，所有(提问, 片段)组合按批送入cross-encoder
+def retrieve_all(questions: List[str], store, keyword_index, top_k1: int, top_k2: int) -> List[List[str]]:
+    with tracing.span("batch_embed", queries=len(questions)):
+        embeddings = model_registry.get_embedding_model().encode(questions, batch_size=knowledge_base.EMBED_BATCH_SIZE)
+    embedding_model = PrecomputedEmbeddings(questions, embeddings)
+    candidate_lists = [retrieval.retrieve_candidates(question, store, embedding_model, top_k1, keyword_index)[0]
+                       for question in questions]
+    return retrieval.rerank_many(questions, candidate_lists, model_registry.get_cross_encoder(), top_k2)
+
+
+# 回答单个问题；模型请求的重试已在LLMClient中完成，这里只记录最终的错误
+def answer_question(answer_pipeline: pipeline.AnswerPipeline, question: str, chunks: List[str]) -> Dict:
+    stats = {}
+    try:
+        answer = answer_pipeline.generate_answer(question, stats, rag_chunks=chunks)
+        return {"answer": answer, "stats": stats}
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "stats": stats}
+
+
+# model_factory返回实际的模型；每次实际发出的请求（包括重试）都先经过限速器
+def run_batch(items: List[Dict[str, str]], output: str, concurrency: int, requests_per_minute: float,
+              retries: int, backoff: float, top_k1: int, top_k2: int, hybrid: bool,
+              model_factory=pipeline.create_model) -> Dict[str, int]:
+    if not items:
+        return {"answered": 0, "failed": 0}
+    store = knowledge_base.get_store()
+    keyword_index = lexical_index.LexicalIndex.from_store(store) if hybrid else None
+    questions = [item["question"] for item in items]
+    all_chunks = retrieve_all(questions, store, keyword_index, top_k1, top_k2)
+
+    limiter = RateLimiter(requests_per_minute)
+    client = llm_client.LLMClient(lambda: RateLimitedModel(model_factory(), limiter), max_concurrency=concurrency,
+                                  max_retries=retries, backoff_base=backoff)
+    answer_pipeline = pipeline.AnswerPipeline(store, model_registry.get_query_cache(), model_registry.get_cross_encoder(),
+                                              keyword_index=keyword_index, model_factory=lambda: client)
+    write_lock = threading.Lock()
+    counts = {"answered": 0, "failed": 0}
+    with open(output, "a", encoding="utf-8") as file, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        futures = {
+            executor.submit(answer_question, answer_pipeline, item["question"], chunks): (item, chunks)
+            for item, chunks in zip(items, all_chunks)
+        }
+        for future in as_completed(futures):
+            item, chunks = futures[future]
+            record = {"id": item["id"], "question": item["question"], "chunks": chunks, **future.result()}
+            # 每完成一个问题立即追加写入，中断后可从已写入的结果继续
+            with write_lock:
+                file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                file.flush()
+            counts["failed" if "error" in record else "answered"] += 1
+            print(f"[{counts['answered'] + counts['failed']}/{len(items)}] {item['question']}"
+                  + (f" 失败: {record['error']}" if "error" in record else ""))
+    return counts
+
+
+# 批量问答入口：python batch_qa.py 问题文件 答案文件.jsonl
+def main() -> None:
+    parser = argparse.ArgumentParser(description="批量回答问题文件中的问题，结果写入JSONL，可从中断处继续")
+    parser.add_argument("questions", help="问题文件，每行一个问题，或每行为{\"question\": ...}的JSONL")
+    parser.add_argument("output", help="答案文件（JSONL），已成功回答的问题不再重复回答")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同时进行的回答数")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="每分钟最多的模型请求数，0为不限速")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="模型请求遇到临时性错误后的重试次数")
+    parser.add_argument("--backoff", type=float, default=RETRY_BACKOFF, help="重试退避等待的基数（秒），实际等待在0到基数*2^n间随机")
+    parser.add_argument("--top-k1", type=int, default=10, help="召回的片段数")
+    parser.add_argument("--top-k2", type=int, default=4, help="重排后保留的片段数")
+    parser.add_argument("--no-hybrid", action="store_true", help="只使用向量召回")
+    parser.add_argument("--crop-backend", choices=["memory", "sql"], default=tools.CROP_BACKEND,
+                        help="作物工具的执行后端，sql为所有线程共享的只读连接")
+    args = parser.parse_args()
+
+    tools.CROP_BACKEND = args.crop_backend
+    pipeline.configure_genai(os.environ.get("GOOGLE_API_KEY"))
+
+    items = load_questions(args.questions)
+    finished = load_finished(args.output)
+    pending = [item for item in items if item["id"] not in finished]
+    print(f"共{len(items)}个问题，已完成{len(items) - len(pending)}个，待回答{len(pending)}个")
+
+    start = time.perf_counter()
+    counts = run_batch(pending, args.output, args.concurrency, args.rpm, args.retries, args.backoff,
+                       args.top_k1, args.top_k2, not args.no_hybrid)
+    print(f"回答{counts['answered']}个，失败{counts['failed']}个，耗时{time.perf_counter() - start:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
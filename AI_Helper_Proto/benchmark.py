@@ -0,0 +1,270 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+import context
+import fake_llm
+import knowledge_base
+import lexical_index
+import llm_client
+import model_registry
+import pipeline
+import tools
+import tracing
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(BASE_DIR, "benchmark_golden.jsonl")
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+# 延迟分位数超过基准的比例、召回指标低于基准的差值超过以下阈值时视为退化
+LATENCY_TOLERANCE = 0.2
+QUALITY_TOLERANCE = 0.01
+# 延迟增加不足该值（毫秒）时视为测量噪声
+LATENCY_FLOOR_MS = 1.0
+
+
+# 按阶段记录耗时（毫秒），预取线程和工具线程会同时写入
+class StageTimer:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.samples[name].append(elapsed)
+
+    def wrap(self, name: str, function):
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "count": len(values),
+                "mean": float(np.mean(values)),
+                "p50": float(np.percentile(values, 50)),
+                "p90": float(np.percentile(values, 90)),
+                "p99": float(np.percentile(values, 99)),
+            }
+            for name, values in sorted(self.samples.items()) if values
+        }
+
+
+# 代理对象：计时指定的方法，其余属性原样转发
+class Timed:
+    def __init__(self, target, method: str, stage: str, timer: StageTimer):
+        self._target = target
+        setattr(self, method, timer.wrap(stage, getattr(target, method)))
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+# 计时作物工具的SQL执行和结果格式化
+@contextlib.contextmanager
+def timed_tools(timer: StageTimer):
+    run_crop_queries, format_crops = tools.run_crop_queries, tools.format_crops
+    tools.run_crop_queries = timer.wrap("tool_sql", run_crop_queries)
+    tools.format_crops = timer.wrap("format", format_crops)
+    try:
+        yield
+    finally:
+        tools.run_crop_queries, tools.format_crops = run_crop_queries, format_crops
+
+
+def load_golden(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# 召回质量：relevant中的每一项为应命中片段所含的文本，
+# recall@k为前k个片段覆盖的比例，倒数排名取第一个命中片段的名次
+def retrieval_metrics(chunks: List[str], relevant: List[str], k: int) -> Dict[str, float]:
+    hits = [any(text in chunk for text in relevant) for chunk in chunks]
+    first_hit = next((rank for rank, hit in enumerate(hits, start=1) if hit), None)
+    covered = [text for text in relevant if any(text in chunk for chunk in chunks[:k])]
+    return {
+        "recall@1": float(bool(hits) and hits[0]),
+        f"recall@{k}": len(covered) / len(relevant),
+        "mrr": 1.0 / first_hit if first_hit else 0.0,
+    }
+
+
+def build_pipeline(timer: StageTimer, hybrid: bool) -> pipeline.AnswerPipeline:
+    store = knowledge_base.get_store()
+    index = lexical_index.LexicalIndex.from_store(store) if hybrid else None
+    embedding_model = Timed(model_registry.get_embedding_model(), "encode", "embed", timer)
+    # 基准测试不使用任何缓存，每次都完整执行各阶段
+    return pipeline.AnswerPipeline(
+        Timed(store, "query", "vector_query", timer),
+        embedding_model,
+        Timed(model_registry.get_cross_encoder(), "predict", "rerank", timer),
+        keyword_index=Timed(index, "search", "bm25", timer) if index is not None else None,
+        context_builder=Timed(context.ContextBuilder(embedding_model, cache_size=0), "build", "build_context", timer),
+    )
+
+
+def run_benchmark(golden: List[dict], repeat: int, top_k1: int, top_k2: int, hybrid: bool,
+                  llm_latency: float) -> dict:
+    timer = StageTimer()
+    bench = build_pipeline(timer, hybrid)
+
+    # 回放模型经由与线上相同的模型客户端调用
+    client = llm_client.LLMClient(lambda: fake_llm.ScriptedGenerativeModel(
+        {item["question"]: item["turns"] for item in golden}, latency=llm_latency))
+    bench.model_factory = lambda: client
+
+    # 关闭预取RAG：预取的向量化和重排与模型调用重叠，会被重复计入answer_total
+    speculative_rag, pipeline.SPECULATIVE_RAG = pipeline.SPECULATIVE_RAG, False
+    try:
+        # 预热：模型首次推理和数据库首次加载不计入结果
+        bench.generate_answer(golden[0]["question"])
+        timer.samples.clear()
+
+        tracemalloc.start()
+        quality: Dict[str, List[float]] = defaultdict(list)
+        rerank_paths: Counter = Counter()
+        context_tokens: Dict[str, List[float]] = defaultdict(list)
+        with timed_tools(timer):
+            for _ in range(repeat):
+                for item in golden:
+                    stats = {}
+                    with timer.stage("retrieve_and_rerank"):
+                        chunks = bench.retrieve_and_rerank(item["question"], top_k1, top_k2, stats)
+                    rerank_paths[stats.get("rerank_path", "full")] += 1
+                    for name, value in retrieval_metrics(chunks, item["relevant"], top_k2).items():
+                        quality[name].append(value)
+
+                    answer_stats = {}
+                    with timer.stage("answer_total"):
+                        bench.generate_answer(item["question"], answer_stats)
+                    if "ttft" in answer_stats:
+                        timer.samples["answer_ttft"].append(answer_stats["ttft"] * 1000)
+                    for name in ("context_tokens_raw", "context_tokens", "prompt_tokens"):
+                        if name in answer_stats:
+                            context_tokens[name].append(answer_stats[name])
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        pipeline.SPECULATIVE_RAG = speculative_rag
+
+    memory = {"python_peak_mb": python_peak / 2 ** 20}
+    try:
+        import resource
+        # Linux上ru_maxrss单位为KB，macOS上为字节
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["max_rss_mb"] = max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+    except ImportError:
+        pass
+
+    return {
+        "config": {"questions": len(golden), "repeat": repeat, "top_k1": top_k1, "top_k2": top_k2,
+                   "hybrid": hybrid, "llm_latency": llm_latency, "model_backend": model_registry.MODEL_BACKEND,
+                   "vector_backend": knowledge_base.VECTOR_BACKEND},
+        "stages": timer.summary(),
+        "retrieval": {name: float(np.mean(values)) for name, values in quality.items()},
+        "rerank_paths": dict(rerank_paths),
+        "tokens": {name: float(np.mean(values)) for name, values in context_tokens.items()},
+        "memory": memory,
+    }
+
+
+# 与基准结果对比，返回退化项
+def compare_with_baseline(result: dict, baseline: dict) -> List[str]:
+    regressions = []
+    for stage, summary in result["stages"].items():
+        reference = baseline.get("stages", {}).get(stage)
+        if not reference:
+            continue
+        for key in ("p50", "p90"):
+            change = summary[key] / reference[key] - 1 if reference[key] > 0 else 0.0
+            print(f"  {stage} {key}: {reference[key]:.1f} -> {summary[key]:.1f} ms ({change:+.0%})")
+            if change > LATENCY_TOLERANCE and summary[key] - reference[key] > LATENCY_FLOOR_MS:
+                regressions.append(f"{stage} {key}")
+    for name, value in result["retrieval"].items():
+        reference = baseline.get("retrieval", {}).get(name)
+        if reference is None:
+            continue
+        print(f"  {name}: {reference:.3f} -> {value:.3f}")
+        if value < reference - QUALITY_TOLERANCE:
+            regressions.append(name)
+    return regressions
+
+
+def print_result(result: dict) -> None:
+    print(f"{'阶段':<22}{'次数':>6}{'p50':>10}{'p90':>10}{'p99':>10}  (ms)")
+    for stage, summary in result["stages"].items():
+        print(f"{stage:<22}{summary['count']:>6}{summary['p50']:>10.1f}{summary['p90']:>10.1f}{summary['p99']:>10.1f}")
+    for name, value in result["retrieval"].items():
+        print(f"{name}: {value:.3f}")
+    print(f"重排路径: {result['rerank_paths']}")
+    for name, value in result["tokens"].items():
+        print(f"平均{name}: {value:.0f}")
+    for name, value in result["memory"].items():
+        print(f"{name}: {value:.1f}")
+
+
+# 离线基准测试入口：python benchmark.py [--baseline 基准文件] [--save-baseline]
+def main() -> None:
+    parser = argparse.ArgumentParser(description="离线端到端RAG基准测试，使用本地回放模型代替Gemini")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="标准问题集（JSONL）")
+    parser.add_argument("--repeat", type=int, default=3, help="问题集重复运行的次数")
+    parser.add_argument("--top-k1", type=int, default=10, help="召回的片段数")
+    parser.add_argument("--top-k2", type=int, default=4, help="重排后保留的片段数")
+    parser.add_argument("--no-hybrid", action="store_true", help="只使用向量召回")
+    parser.add_argument("--vector-backend", choices=["chroma", "flat"], default=knowledge_base.VECTOR_BACKEND,
+                        help="向量库后端")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="模拟每次模型调用的耗时（秒）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="对比的基准结果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基准")
+    parser.add_argument("--output", help="本次结果的保存路径（JSON）")
+    args = parser.parse_args()
+
+    # 基准测试的追踪不写入线上的追踪文件和指标文件
+    tracing.TRACE_TO_FILE = False
+    knowledge_base.VECTOR_BACKEND = args.vector_backend
+    result = run_benchmark(load_golden(args.golden), args.repeat, args.top_k1, args.top_k2,
+                           not args.no_hybrid, args.llm_latency)
+    print_result(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+        print(f"已保存基准结果: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("没有基准结果，使用--save-baseline保存本次结果作为基准")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    print("与基准结果对比:")
+    regressions = compare_with_baseline(result, baseline)
+    if regressions:
+        print(f"性能或召回质量退化: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
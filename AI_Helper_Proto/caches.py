@@ -0,0 +1,133 @@
+import hashlib
+import re
+import threading
+import unicodedata
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import tracing
+
+# 提问向量缓存默认容量
+QUERY_CACHE_SIZE = 512
+# 重排打分缓存默认容量
+SCORE_CACHE_SIZE = 8192
+
+
+# 提问文本归一化：全角转半角、去除首尾及多余空白、英文小写
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query)
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+# 片段文本哈希，作为打分缓存的键
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# 线程安全的定长LRU缓存，记录命中和未命中次数
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # 缓存未命中时调用compute计算并写入
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# 提问向量缓存，位于embedding模型之前，接口与模型的encode一致
+class QueryEmbeddingCache(LRUCache):
+    def __init__(self, embedding_model, maxsize: int = QUERY_CACHE_SIZE):
+        super().__init__(maxsize)
+        self.embedding_model = embedding_model
+
+    def encode(self, query: str):
+        key = normalize_query(query)
+        embedding = self.get(key)
+        result = "hit" if embedding is not None else "miss"
+        if embedding is None:
+            embedding = self._encode(key)
+            self.put(key, embedding)
+        tracing.set_attributes(query_cache=result)
+        tracing.count("aihelper_cache_total", cache="query_embedding", result=result)
+        return embedding
+
+    def _encode(self, query: str):
+        embedding = self.embedding_model.encode(query)
+        # 缓存中的向量被多个会话共享，禁止原地修改
+        embedding.flags.writeable = False
+        return embedding
+
+
+# 模型标识：model_registry加载的模型为"模型名:推理后端"，其他模型按对象区分
+def model_id(model) -> str:
+    return getattr(model, "model_id", None) or f"{type(model).__name__}:{id(model)}"
+
+
+# 重排打分缓存，以(模型标识, 归一化提问, 片段哈希)为键，已打分的组合不再送入cross-encoder；
+# torch和onnx后端的打分不同，分别缓存
+class RerankScoreCache(LRUCache):
+    def __init__(self, maxsize: int = SCORE_CACHE_SIZE):
+        super().__init__(maxsize)
+
+    def score(self, query: str, chunks: List[str], cross_encoder) -> List[float]:
+        normalized = normalize_query(query)
+        model = model_id(cross_encoder)
+        keys = [(model, normalized, text_hash(chunk)) for chunk in chunks]
+        scores = [self.get(key) for key in keys]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        tracing.set_attributes(score_cache_hits=len(chunks) - len(missing), scored=len(missing))
+        tracing.count("aihelper_cache_total", len(chunks) - len(missing), cache="rerank_score", result="hit")
+        tracing.count("aihelper_cache_total", len(missing), cache="rerank_score", result="miss")
+        if missing:
+            computed = cross_encoder.predict([(query, chunks[i]) for i in missing])
+            for i, score in zip(missing, computed):
+                scores[i] = float(score)
+                self.put(keys[i], scores[i])
+        return scores
@@ -0,0 +1,435 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAT_HISTORY = os.path.join(BASE_DIR, "chat_history.jsonl")
+# 旧版整体重写的历史文件，首次使用时迁移
+LEGACY_CHAT_HISTORY = os.path.join(BASE_DIR, "chat_history.json")
+# 按会话分文件保存的JSONL记录目录
+CHAT_HISTORY_DIR = os.path.join(BASE_DIR, "chat_history")
+# 按会话保存的SQLite聊天记录
+CHAT_DB = os.path.join(BASE_DIR, "chat_history.db")
+
+# 倒序读取文件时每次读入的字节数
+READ_BLOCK_SIZE = 64 * 1024
+
+# SQLite后台写线程每批最多写入的消息数
+WRITE_BATCH_SIZE = 64
+# 写线程等待新消息的最长时间（秒）
+FLUSH_INTERVAL = 0.2
+# 每个会话最多保留的消息数
+MAX_MESSAGES_PER_SESSION = 1000
+# 消息保留天数
+MAX_MESSAGE_AGE_DAYS = 30
+# 清理过期消息并压缩数据库的间隔（秒）
+COMPACT_INTERVAL = 600
+# 读取前等待写入完成、关闭时等待写线程退出的最长时间（秒）
+WRITE_TIMEOUT = 10.0
+# 旧版历史文件迁移到的会话id，通过?sid=legacy打开
+LEGACY_SESSION_ID = "legacy"
+
+_SESSION_ID_PATTERN = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+
+logger = logging.getLogger("aihelper.chat_store")
+
+
+# 会话id只允许字母、数字、下划线和连字符，避免被用作文件路径时越界
+def is_valid_session_id(session_id: Optional[str]) -> bool:
+    return bool(session_id) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+
+def _strip_cursor(message: Dict) -> Dict:
+    return {key: value for key, value in message.items() if key != "cursor"}
+
+
+# 追加写入的聊天记录：每条消息一行JSON，追加为O(1)，
+# 读取时从文件末尾倒序按页加载，只解析需要显示的消息
+class JsonlChatStore:
+    def __init__(self, path: str = CHAT_HISTORY, legacy_path: Optional[str] = LEGACY_CHAT_HISTORY):
+        self.path = path
+        self._lock = threading.Lock()
+        if legacy_path and not os.path.exists(path) and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        self._repair_tail()
+
+    def _migrate(self, legacy_path: str) -> None:
+        with open(legacy_path, "r", encoding="utf-8") as file:
+            messages = json.load(file)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            for message in messages:
+                file.write(json.dumps(message, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    # 上次写入中途崩溃时最后一行不完整，截断到最后一个换行符，去掉这半行
+    def _repair_tail(self) -> None:
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as file:
+            end = file.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(READ_BLOCK_SIZE, pos)
+                file.seek(pos - step)
+                block = file.read(step)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            if pos != end:
+                file.truncate(pos)
+
+    # 追加一条消息，返回其游标（行起始字节位置）
+    def append(self, message: Dict) -> int:
+        return self.extend([message])[0]
+
+    # 一次写入多条消息，写完后fsync保证落盘；消息中的cursor字段不写入文件
+    def extend(self, messages: List[Dict]) -> List[int]:
+        lines = [(json.dumps(_strip_cursor(message), ensure_ascii=False) + "\n").encode("utf-8")
+                 for message in messages]
+        with self._lock:
+            with open(self.path, "ab") as file:
+                position = file.seek(0, os.SEEK_END)
+                file.write(b"".join(lines))
+                file.flush()
+                os.fsync(file.fileno())
+        cursors = []
+        for line in lines:
+            cursors.append(position)
+            position += len(line)
+        return cursors
+
+    # 读取offset（字节位置，None为文件末尾）之前的最多limit条消息，
+    # 返回按时间顺序排列的消息（cursor字段为各自的行起始位置），以及这批消息起始位置，用作加载更早消息时的offset
+    def read_before(self, offset: Optional[int] = None, limit: int = 20) -> Tuple[List[Dict], int]:
+        if not os.path.exists(self.path):
+            return [], 0
+        with open(self.path, "rb") as file:
+            end = file.seek(0, os.SEEK_END) if offset is None else offset
+            pos, buffer = end, b""
+            # 读到比limit多一个换行符，保证最前面被截断的那一行之后至少有limit条完整消息
+            while pos > 0 and buffer.count(b"\n") <= limit:
+                step = min(READ_BLOCK_SIZE, pos)
+                pos -= step
+                file.seek(pos)
+                buffer = file.read(step) + buffer
+
+        lines = buffer.split(b"\n")
+        start = pos
+        if pos > 0:
+            start += len(lines[0]) + 1
+            lines = lines[1:]
+
+        # 记录每一行的起始位置
+        located = []
+        for line in lines:
+            if line.strip():
+                located.append((start, line))
+            start += len(line) + 1
+
+        # 先解析再取最后limit条，无法解析的损坏行不占用条数
+        parsed = []
+        for cursor, line in located:
+            try:
+                parsed.append({**json.loads(line), "cursor": cursor})
+            except ValueError:
+                continue
+        messages = parsed[-limit:] if limit > 0 else []
+        first_offset = messages[0]["cursor"] if messages else 0
+        return messages, first_offset
+
+    def load_recent(self, limit: int = 20) -> Tuple[List[Dict], int]:
+        return self.read_before(None, limit)
+
+    def clear(self) -> None:
+        with self._lock:
+            with open(self.path, "wb") as file:
+                file.flush()
+                os.fsync(file.fileno())
+
+
+# 按会话分文件的JSONL聊天记录，单用户或少量会话时使用
+class JsonlSessionStore:
+    def __init__(self, directory: str = CHAT_HISTORY_DIR, legacy_path: Optional[str] = LEGACY_CHAT_HISTORY):
+        self.directory = directory
+        self._sessions: Dict[str, JsonlChatStore] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # 旧版历史文件迁移为独立的会话
+        if legacy_path:
+            self._sessions[LEGACY_SESSION_ID] = JsonlChatStore(self._path(LEGACY_SESSION_ID), legacy_path)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def session(self, session_id: str) -> JsonlChatStore:
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"非法的会话id: {session_id}")
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = JsonlChatStore(self._path(session_id), legacy_path=None)
+            return self._sessions[session_id]
+
+
+# 按会话保存的SQLite聊天记录（WAL模式）：写入由后台线程成批提交，读取不阻塞写入；
+# 定期按条数和时间清理旧消息并压缩数据库
+class SqliteChatStore:
+    def __init__(self, path: str = CHAT_DB, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, max_messages: int = MAX_MESSAGES_PER_SESSION,
+                 max_age_days: float = MAX_MESSAGE_AGE_DAYS, compact_interval: float = COMPACT_INTERVAL,
+                 legacy_path: Optional[str] = LEGACY_CHAT_HISTORY):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_messages = max_messages
+        self.max_age_days = max_age_days
+        self.compact_interval = compact_interval
+        self._local = threading.local()
+        self._seq_lock = threading.Lock()
+        self._last_seq = 0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        # 各会话已提交但尚未写入的操作数，读取某个会话前只等待该会话的写入
+        self._pending: Dict[str, int] = {}
+        self._pending_cond = threading.Condition()
+        self._closed = False
+
+        self._enable_auto_vacuum()
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session_seq ON messages(session_id, seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+
+        self._writer = threading.Thread(target=self._write_loop, name="chat-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # WAL模式下修改auto_vacuum不会生效：先切回回滚日志模式，设置后VACUUM重建一次数据库，之后再进入WAL
+    def _enable_auto_vacuum(self) -> None:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                conn.execute("PRAGMA journal_mode = DELETE")
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    # 旧版历史文件只迁移一次，写入LEGACY_SESSION_ID会话，迁移状态记在meta表中
+    def _migrate(self, legacy_path: str) -> None:
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+                return
+            with open(legacy_path, "r", encoding="utf-8") as file:
+                messages = json.load(file)
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(LEGACY_SESSION_ID, self._next_seq(), message["role"], message["content"], now)
+                 for message in messages])
+            conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_migrated', ?)", (legacy_path,))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    # 每个线程一个只读连接
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # 单调递增的消息序号，也是分页游标
+    def _next_seq(self) -> int:
+        with self._seq_lock:
+            self._last_seq = max(time.time_ns(), self._last_seq + 1)
+            return self._last_seq
+
+    def session(self, session_id: str) -> "SessionChatHistory":
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"非法的会话id: {session_id}")
+        return SessionChatHistory(self, session_id)
+
+    def _submit(self, session_id: str, op: str, payload) -> None:
+        with self._pending_cond:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        self._queue.put((op, payload))
+
+    # 写线程提交一批操作后调用，唤醒等待这些会话的读取
+    def _done(self, session_ids: List[str]) -> None:
+        with self._pending_cond:
+            for session_id in session_ids:
+                self._pending[session_id] -= 1
+                if not self._pending[session_id]:
+                    del self._pending[session_id]
+            self._pending_cond.notify_all()
+
+    def append(self, session_id: str, message: Dict) -> int:
+        seq = self._next_seq()
+        self._submit(session_id, "insert", (session_id, seq, message["role"], message["content"], time.time()))
+        return seq
+
+    def clear(self, session_id: str) -> None:
+        self._submit(session_id, "clear", session_id)
+        self.flush_session(session_id)
+
+    # 等待已提交的写入全部完成，最多等待timeout秒
+    def flush(self, timeout: float = WRITE_TIMEOUT) -> None:
+        with self._pending_cond:
+            if not self._pending_cond.wait_for(lambda: self._closed or not self._pending, timeout):
+                logger.warning("等待聊天记录写入超时")
+
+    # 只等待某个会话已提交的写入完成，不受其他会话的写入影响；超时后读取已写入的部分
+    def flush_session(self, session_id: str, timeout: float = WRITE_TIMEOUT) -> None:
+        with self._pending_cond:
+            if not self._pending_cond.wait_for(lambda: self._closed or not self._pending.get(session_id), timeout):
+                logger.warning("等待会话%s的聊天记录写入超时", session_id)
+
+    # 读取cursor之前的最多limit条消息，返回按时间顺序排列的消息和更早消息的游标（没有更早消息时为0）
+    def read_before(self, session_id: str, cursor: Optional[int] = None, limit: int = 20) -> Tuple[List[Dict], int]:
+        self.flush_session(session_id)
+        rows = self._reader().execute(
+            "SELECT seq, role, content FROM messages WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+            (session_id, cursor if cursor is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        messages = [{"role": role, "content": content, "cursor": seq} for seq, role, content in rows]
+        return messages, (rows[0][0] if has_more and rows else 0)
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        last_compact = time.monotonic()
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            # 取出队列中已有的消息，合并为一次事务提交
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(op == "stop" for op, _ in batch)
+            # 写入出错（数据库被锁、磁盘已满等）时丢弃这一批并记录日志，写线程继续运行；
+            # 无论成功与否都标记这一批已完成，等待写入的读取和关闭不会一直阻塞
+            try:
+                self._write_batch(conn, batch)
+            except Exception:
+                logger.exception("聊天记录写入失败，丢弃%d条操作", len(batch))
+            finally:
+                self._done([payload[0] if op == "insert" else payload for op, payload in batch if op != "stop"])
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                conn.close()
+                return
+            if time.monotonic() - last_compact > self.compact_interval:
+                try:
+                    self.compact(conn)
+                except Exception:
+                    logger.exception("聊天记录压缩失败")
+                last_compact = time.monotonic()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        inserts = []
+        for op, payload in batch:
+            if op == "insert":
+                inserts.append(payload)
+                continue
+            self._insert(conn, inserts)
+            inserts = []
+            if op == "clear":
+                with conn:
+                    conn.execute("DELETE FROM messages WHERE session_id = ?", (payload,))
+        self._insert(conn, inserts)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        if rows:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+
+    # 清理过期消息和超出条数上限的旧消息，然后截断WAL并回收空闲页
+    def compact(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                deleted = conn.execute("DELETE FROM messages WHERE created_at < ?",
+                                       (time.time() - self.max_age_days * 86400,)).rowcount
+                deleted += conn.execute("""DELETE FROM messages WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY seq DESC) AS rank
+                        FROM messages
+                    ) WHERE rank > ?
+                )""", (self.max_messages,)).rowcount
+            if deleted:
+                # execute只执行一步，只释放一页；executescript会执行到底，释放全部空闲页
+                conn.executescript("PRAGMA incremental_vacuum")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return deleted
+        finally:
+            if own_conn:
+                conn.close()
+
+    # 写线程处理完队列中已有的操作后退出，最多等待timeout秒
+    def close(self, timeout: float = WRITE_TIMEOUT) -> None:
+        if self._closed:
+            return
+        self._queue.put(("stop", None))
+        self._writer.join(timeout=timeout)
+        if self._writer.is_alive():
+            logger.warning("聊天记录写线程未在%.0f秒内退出", timeout)
+        with self._pending_cond:
+            self._closed = True
+            self._pending_cond.notify_all()
+
+
+# 绑定到单个会话的聊天记录，接口与JsonlChatStore一致
+class SessionChatHistory:
+    def __init__(self, store: SqliteChatStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    def append(self, message: Dict) -> int:
+        return self.store.append(self.session_id, message)
+
+    def extend(self, messages: List[Dict]) -> List[int]:
+        return [self.append(message) for message in messages]
+
+    def read_before(self, cursor: Optional[int] = None, limit: int = 20) -> Tuple[List[Dict], int]:
+        return self.store.read_before(self.session_id, cursor, limit)
+
+    def load_recent(self, limit: int = 20) -> Tuple[List[Dict], int]:
+        return self.read_before(None, limit)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -0,0 +1,105 @@
+import argparse
+import sys
+import time
+
+from typing import Dict, List
+
+import numpy as np
+
+import knowledge_base
+import model_registry
+import retrieval
+
+# 对比用的示例提问
+SAMPLE_QUERIES = [
+    "草莓从种植到成熟要几天？",
+    "春季种什么作物收益最高？",
+    "哪些作物需要棚架？",
+    "上古水果在哪些季节生长？",
+    "巨大作物是怎么形成的？",
+    "铱星品质的作物怎么获得？",
+    "温室里可以种哪些作物？",
+    "咖啡豆的种子在哪里买？",
+    "混合种子在冬天能种吗？",
+    "哪个农场地图最适合钓鱼？",
+]
+
+# 通过对比所需的最低指标：提问向量余弦相似度、召回前k个的重合率、重排前k个的重合率
+MIN_COSINE = 0.99
+MIN_RETRIEVAL_OVERLAP = 0.9
+MIN_RERANK_OVERLAP = 0.9
+
+
+def _top_k(query_embeddings: np.ndarray, doc_embeddings: np.ndarray, k: int) -> np.ndarray:
+    # 与chromadb默认的l2距离及平铺索引的距离一致
+    distances = ((query_embeddings[:, None, :] - doc_embeddings[None, :, :]) ** 2).sum(axis=-1)
+    return np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+
+def _overlap(reference: List[List], candidate: List[List]) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(reference, candidate) if a]))
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+# 以知识库中已保存的片段向量为准，对比两种后端的提问向量、向量召回结果和重排结果
+def compare_backends(queries: List[str], reference: str, candidate: str, top_k1: int, top_k2: int) -> Dict[str, float]:
+    data = knowledge_base.get_store().get(embeddings=True)
+    documents = data['documents']
+    doc_embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+
+    results = {}
+    query_embeddings = {}
+    for backend in (reference, candidate):
+        model = model_registry.get_embedding_model(backend)
+        # 第一次调用包含模型预热，不计入耗时
+        model.encode(queries[:1])
+        query_embeddings[backend], results[f"{backend}_encode_ms"] = _timed(
+            lambda: np.asarray(model.encode(queries), dtype=np.float32))
+
+    a, b = query_embeddings[reference], query_embeddings[candidate]
+    cosines = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    results["min_cosine"] = float(cosines.min())
+
+    reference_hits = _top_k(a, doc_embeddings, top_k1).tolist()
+    results["retrieval_overlap"] = _overlap(reference_hits, _top_k(b, doc_embeddings, top_k1).tolist())
+
+    # 两种重排模型对同一批候选打分
+    reranked = {}
+    for backend in (reference, candidate):
+        cross_encoder = model_registry.get_cross_encoder(backend)
+        cross_encoder.predict([(queries[0], documents[reference_hits[0][0]])])
+        reranked[backend], results[f"{backend}_rerank_ms"] = _timed(lambda: [
+            retrieval.rerank(query, [documents[i] for i in hits], cross_encoder, top_k2)
+            for query, hits in zip(queries, reference_hits)
+        ])
+    results["rerank_overlap"] = _overlap(reranked[reference], reranked[candidate])
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比推理后端与PyTorch全精度模型的召回、重排结果")
+    parser.add_argument("--backend", default="onnx", help="待检查的推理后端")
+    parser.add_argument("--reference", default="torch", help="作为基准的推理后端")
+    parser.add_argument("--top-k1", type=int, default=10, help="向量召回的片段数")
+    parser.add_argument("--top-k2", type=int, default=4, help="重排后保留的片段数")
+    parser.add_argument("queries", nargs="*", default=SAMPLE_QUERIES)
+    args = parser.parse_args()
+
+    results = compare_backends(args.queries, args.reference, args.backend, args.top_k1, args.top_k2)
+    for name, value in results.items():
+        print(f"{name}: {value:.4f}")
+
+    passed = (results["min_cosine"] >= MIN_COSINE
+              and results["retrieval_overlap"] >= MIN_RETRIEVAL_OVERLAP
+              and results["rerank_overlap"] >= MIN_RERANK_OVERLAP)
+    print("结果一致，可以切换后端" if passed else "结果差异超出阈值，不建议切换后端")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
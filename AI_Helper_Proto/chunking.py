@@ -0,0 +1,98 @@
+import re
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# 每个片段的最大token数（不含[CLS]/[SEP]），不超过编码模型的最大序列长度
+CHUNK_MAX_TOKENS = 120
+# 同一段落相邻片段之间重叠的token数
+CHUNK_OVERLAP_TOKENS = 24
+
+# 作物段落以"作物名："开头，如"草莓：春季作物，..."
+_SECTION_PATTERN = re.compile(r"^([^，。：:,\s]{1,8})[：:]")
+# 句末标点，片段边界优先落在句末
+SENTENCE_ENDS = "。！？；!?;"
+
+
+@dataclass
+class Chunk:
+    text: str
+    # 所属作物名，通用说明段落为空字符串
+    section: str = ""
+    # 在所属段落中的序号
+    part: int = 0
+    tokens: int = 0
+
+    def metadata(self) -> Dict[str, object]:
+        return {"section": self.section, "part": self.part, "tokens": self.tokens}
+
+
+# 段落开头的作物名
+def detect_section(paragraph: str) -> str:
+    match = _SECTION_PATTERN.match(paragraph)
+    return match.group(1) if match else ""
+
+
+def count_tokens(tokenizer, text: str) -> int:
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+# 将一个段落切成不超过max_tokens的窗口，相邻窗口重叠约overlap个token；
+# 切分点尽量落在句末，找不到时按token切分
+def split_paragraph(paragraph: str, tokenizer, max_tokens: int = CHUNK_MAX_TOKENS,
+                    overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    section = detect_section(paragraph)
+    offsets = tokenizer(paragraph, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    n = len(offsets)
+    if n <= max_tokens:
+        return [Chunk(paragraph, section, 0, n)]
+
+    # 后续片段以作物名开头，保证每个片段都能对应到所属作物
+    prefix = f"{section}：" if section else ""
+    prefix_tokens = count_tokens(tokenizer, prefix) if prefix else 0
+    overlap = min(overlap, max_tokens // 2)
+    sentence_ends = [i for i, (_, end) in enumerate(offsets) if end and paragraph[end - 1] in SENTENCE_ENDS]
+
+    chunks: List[Chunk] = []
+    start = 0
+    while True:
+        extra = prefix_tokens if chunks else 0
+        budget = max_tokens - extra
+        end = min(start + budget, n)
+        if end < n:
+            # 窗口后半段内最后一个句末
+            boundary = _last_between(sentence_ends, start + budget // 2, end - 1)
+            if boundary is not None:
+                end = boundary + 1
+        text = paragraph[offsets[start][0]:offsets[end - 1][1]]
+        if extra:
+            text = prefix + text
+        chunks.append(Chunk(text, section, len(chunks), end - start + extra))
+        if end >= n:
+            return chunks
+
+        # 下一个片段从重叠区内第一个句子开头开始，重叠区内没有句末时直接回退overlap个token
+        next_start = max(end - overlap, start + 1)
+        boundary = _first_between(sentence_ends, next_start, end - 2)
+        start = boundary + 1 if boundary is not None else next_start
+
+
+def _last_between(positions: List[int], low: int, high: int) -> Optional[int]:
+    candidates = [p for p in positions if low <= p <= high]
+    return candidates[-1] if candidates else None
+
+
+def _first_between(positions: List[int], low: int, high: int) -> Optional[int]:
+    candidates = [p for p in positions if low <= p <= high]
+    return candidates[0] if candidates else None
+
+
+# 按空行切分段落后，把每个段落切成长度受限的片段
+def chunk_text(content: str, tokenizer, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    chunks: List[Chunk] = []
+    for paragraph in content.split("\n\n"):
+        paragraph = paragraph.strip()
+        if paragraph:
+            chunks.extend(split_paragraph(paragraph, tokenizer, max_tokens, overlap))
+    return chunks
@@ -0,0 +1,119 @@
+import re
+import threading
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import caches
+import chunking
+import model_registry
+import tracing
+
+# 整理后送入模型的RAG上下文的token预算
+CONTEXT_TOKEN_BUDGET = 300
+# 句子向量缓存容量，知识库中的句子会在不同提问间反复出现
+SENTENCE_CACHE_SIZE = 4096
+
+_SENTENCE_PATTERN = re.compile(rf"[^{chunking.SENTENCE_ENDS}\n]+[{chunking.SENTENCE_ENDS}]?")
+
+
+# 把片段切成(作物名, 句子)，去掉片段开头的"作物名："；
+# 相邻片段重叠部分中重复的句子只保留一次，切分点不在句末时留下的残句若被其他句子包含也一并去掉
+def split_sentences(chunks: Sequence[str]) -> List[Tuple[str, str]]:
+    sentences = []
+    seen = set()
+    for chunk in chunks:
+        section = chunking.detect_section(chunk)
+        body = chunk[len(section) + 1:] if section else chunk
+        for sentence in _SENTENCE_PATTERN.findall(body):
+            sentence = sentence.strip()
+            key = (section, caches.normalize_query(sentence))
+            if sentence and key not in seen:
+                seen.add(key)
+                sentences.append((section, sentence))
+    return [
+        (section, sentence) for section, sentence in sentences
+        if not any(other != sentence and other_section == section and sentence in other
+                   for other_section, other in sentences)
+    ]
+
+
+# 按作物分组排版：每个作物一行，以【作物名】开头，组内句子直接相连，比片段列表的repr更省token
+def format_context(sentences: Sequence[Tuple[str, str]]) -> str:
+    groups: Dict[str, List[str]] = {}
+    for section, sentence in sentences:
+        groups.setdefault(section, []).append(sentence)
+    return "\n".join((f"【{section}】" if section else "") + "".join(parts) for section, parts in groups.items())
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+# 上下文整理：去重后的句子不超过token预算时全部保留；超出时用embedding模型计算各句与提问的相似度，
+# 按相似度从高到低选入预算内的句子，再按原顺序排版。token数按embedding模型的分词器计算
+class ContextBuilder:
+    def __init__(self, embedding_model, tokenizer=None, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 cache_size: int = SENTENCE_CACHE_SIZE):
+        self.embedding_model = embedding_model
+        self.token_budget = token_budget
+        self.sentence_cache = caches.LRUCache(cache_size)
+        self._tokenizer = tokenizer
+        # 快速分词器不能被多个线程同时调用
+        self._tokenizer_lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = model_registry.get_tokenizer()
+        return self._tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        with self._tokenizer_lock:
+            return chunking.count_tokens(self.tokenizer, text)
+
+    # 句子向量，未缓存的句子一次批量编码；提问向量缓存只接受单个提问，批量编码时使用其背后的模型
+    def _sentence_embeddings(self, texts: List[str]) -> np.ndarray:
+        keys = [caches.text_hash(text) for text in texts]
+        vectors = [self.sentence_cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            model = getattr(self.embedding_model, "embedding_model", self.embedding_model)
+            encoded = model.encode([texts[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.sentence_cache.put(keys[i], vector)
+        return np.stack(vectors).astype(np.float32)
+
+    # 按与提问的相似度选出预算内的句子，返回其下标（按原顺序）；最相关的句子即使超出预算也保留
+    def _select(self, query: str, sentences: List[Tuple[str, str]], tokens: List[int]) -> List[int]:
+        texts = [f"{section}：{sentence}" if section else sentence for section, sentence in sentences]
+        query_vector = _normalize_rows(np.asarray(self.embedding_model.encode(query), dtype=np.float32))
+        scores = _normalize_rows(self._sentence_embeddings(texts)) @ query_vector
+        chosen, used = [], 0
+        for i in np.argsort(-scores, kind="stable"):
+            if not chosen or used + tokens[i] <= self.token_budget:
+                chosen.append(int(i))
+                used += tokens[i]
+        return sorted(chosen)
+
+    # 返回整理后的上下文；整理前后的token数写入stats
+    def build(self, query: str, chunks: Sequence[str], stats: Optional[dict] = None) -> str:
+        stats = {} if stats is None else stats
+        with tracing.span("build_context", chunks=len(chunks), budget=self.token_budget) as span:
+            sentences = split_sentences(chunks)
+            tokens = [self.count_tokens(sentence) for _, sentence in sentences]
+            raw_tokens = sum(self.count_tokens(chunk) for chunk in chunks)
+            keep = list(range(len(sentences)))
+            if sum(tokens) > self.token_budget:
+                keep = self._select(query, sentences, tokens)
+            context = format_context([sentences[i] for i in keep])
+            context_tokens = sum(tokens[i] for i in keep)
+
+            stats["context_tokens_raw"] = raw_tokens
+            stats["context_tokens"] = context_tokens
+            span.set(sentences=len(sentences), kept=len(keep), tokens_raw=raw_tokens, tokens=context_tokens)
+        tracing.count("aihelper_context_tokens_total", raw_tokens, kind="raw")
+        tracing.count("aihelper_context_tokens_total", context_tokens, kind="kept")
+        return context
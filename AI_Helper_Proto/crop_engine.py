@@ -0,0 +1,110 @@
+import os
+import threading
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import crop_query
+
+from crop_query import CropQuery, NUMERIC_COLUMNS
+
+
+# 内存列式作物引擎：将crops表一次性读入NumPy列数组，用向量化掩码完成筛选，
+# 并为每个数值列预先计算升序和降序的排序下标（取值相同时按id）；数据库文件变化时自动重新加载
+class CropEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._rows: List[Dict] = []
+        self._columns: Dict[str, np.ndarray] = {}
+        self._sorted: Dict[str, np.ndarray] = {}
+
+    # 以文件修改时间和大小判断数据库是否变化
+    def _file_signature(self):
+        stat = os.stat(crop_query.DB_PATH)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _ensure_loaded(self) -> None:
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature != self._signature:
+                self._load()
+                self._signature = signature
+
+    def _load(self) -> None:
+        rows = crop_query.execute("SELECT * FROM crops ORDER BY id")
+
+        columns = {}
+        for column in NUMERIC_COLUMNS:
+            # NULL记为NaN，范围比较时自然被排除，与SQL行为一致
+            columns[column] = np.array([np.nan if row[column] is None else row[column] for row in rows],
+                                       dtype=np.float64)
+        # 数据库未能迁移时由season字符串计算位掩码
+        columns['season_mask'] = np.array([row['season_mask'] if 'season_mask' in row
+                                           else crop_query.season_to_mask(row['season']) for row in rows],
+                                          dtype=np.int8)
+        columns['grow_type'] = np.array([row['grow_type'] for row in rows], dtype=object)
+
+        # 行按id顺序读入，稳定排序使取值相同的行按id排列，与SQL的ORDER BY 列, id一致
+        sorted_index = {}
+        for column in NUMERIC_COLUMNS:
+            values = columns[column]
+            nulls = np.flatnonzero(np.isnan(values))
+            not_nulls = np.flatnonzero(~np.isnan(values))
+            # 与SQLite一致：升序时NULL在最前，降序时在最后
+            sorted_index[(column, "ASC")] = np.concatenate(
+                [nulls, not_nulls[np.argsort(values[not_nulls], kind='stable')]])
+            sorted_index[(column, "DESC")] = np.concatenate(
+                [not_nulls[np.argsort(-values[not_nulls], kind='stable')], nulls])
+
+        # 整体替换，查询线程总能看到一致的一份数据
+        self._rows, self._columns, self._sorted = rows, columns, sorted_index
+
+    def run_query(self, query: CropQuery) -> List[Dict]:
+        self._ensure_loaded()
+        rows, columns, sorted_index = self._rows, self._columns, self._sorted
+
+        mask = np.ones(len(rows), dtype=bool)
+        if query.season is not None:
+            # season_mask只有16种取值，先标记允许的取值再按列展开
+            allowed = np.zeros(crop_query.ALL_SEASONS + 1, dtype=bool)
+            allowed[query.season_masks] = True
+            mask &= allowed[columns['season_mask']]
+        for column, (low, high) in query.ranges.items():
+            values = columns[column]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        if query.grow_type is not None:
+            mask &= columns['grow_type'] == query.grow_type
+
+        if query.order:
+            order = sorted_index[(query.sort_column, query.order)]
+            indices = order[mask[order]]
+        else:
+            indices = np.flatnonzero(mask)
+
+        if query.limit is not None:
+            indices = indices[:query.limit]
+        return [rows[i] for i in indices]
+
+    def run_queries(self, queries: Sequence[CropQuery]) -> List[List[Dict]]:
+        return [self.run_query(query) for query in queries]
+
+
+_engine: Optional[CropEngine] = None
+_engine_lock = threading.Lock()
+
+
+# 进程内共享的作物引擎
+def get_engine() -> CropEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = CropEngine()
+    return _engine
@@ -0,0 +1,241 @@
+import functools
+import os
+import pathlib
+import sqlite3
+import threading
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "stardewValley.db")
+
+# 支持范围筛选和排序的数值列
+NUMERIC_COLUMNS = ["seed_price", "sell_price", "grow_time", "maturity_time", "daily_revenue"]
+# 每个连接缓存的预编译语句数
+STATEMENT_CACHE_SIZE = 128
+
+# 季节位掩码：crops.season_mask由season字符串归一化而来，"无"为0
+SEASON_BITS = {"春": 1, "夏": 2, "秋": 4, "冬": 8}
+ALL_SEASONS = 15
+# 由season字符串计算位掩码的SQL表达式，迁移和触发器共用
+SEASON_MASK_SQL = " + ".join(f"(instr({{col}}, '{name}') > 0) * {bit}" for name, bit in SEASON_BITS.items())
+# 数据库无法迁移（如只读文件）时的季节筛选：逐行用LIKE匹配季节字符串，结果与season_mask一致，但不走索引
+SEASON_LIKE_SQL = "(" + " + ".join(f"(season LIKE '%{name}%') * {bit}" for name, bit in SEASON_BITS.items()) + ")"
+
+# 季节归一化及常用排序查询所需的表结构
+SEASON_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS idx_crops_season_daily_revenue ON crops(season_mask, daily_revenue)",
+    "CREATE INDEX IF NOT EXISTS idx_crops_season_sell_price ON crops(season_mask, sell_price)",
+    f"""CREATE TRIGGER IF NOT EXISTS crops_season_mask_insert AFTER INSERT ON crops BEGIN
+        UPDATE crops SET season_mask = {SEASON_MASK_SQL.format(col="NEW.season")} WHERE id = NEW.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS crops_season_mask_update AFTER UPDATE OF season ON crops BEGIN
+        UPDATE crops SET season_mask = {SEASON_MASK_SQL.format(col="NEW.season")} WHERE id = NEW.id;
+    END""",
+]
+
+
+# "全季节"、"四季"指任一季节均可，而不是同时属于四个季节
+def means_any_season(season: str) -> bool:
+    return "全" in season or "四季" in season
+
+
+# 将季节描述转换为位掩码，如"春夏"->3，"全季节"->15
+def season_to_mask(season: str) -> int:
+    if means_any_season(season):
+        return ALL_SEASONS
+    mask = 0
+    for name, bit in SEASON_BITS.items():
+        if name in season:
+            mask |= bit
+    return mask
+
+
+# 满足条件的所有season_mask取值：any为与所给季节有交集，all为包含所给全部季节
+# 取值只有16种，季节筛选因此可以写成season_mask IN (...)走索引；mask为0时没有匹配的取值
+def matching_masks(mask: int, match: str = "all") -> List[int]:
+    if mask == 0:
+        return []
+    if match == "any":
+        return [value for value in range(ALL_SEASONS + 1) if value & mask]
+    return [value for value in range(1, ALL_SEASONS + 1) if value & mask == mask]
+
+
+# 一次作物查询：季节（any为满足任一季节，all为同时满足全部季节）、任意数值列的范围筛选（可同时多个）、
+# 成熟类型、排序列及方向、返回条数
+@dataclass
+class CropQuery:
+    season: Optional[str] = None
+    season_match: str = "all"
+    ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = field(default_factory=dict)
+    grow_type: Optional[str] = None
+    sort_column: Optional[str] = None
+    sort_by: Optional[str] = None
+    top_n: Optional[int] = None
+
+    def __post_init__(self):
+        for column in list(self.ranges) + ([self.sort_column] if self.sort_column else []):
+            if column not in NUMERIC_COLUMNS:
+                raise ValueError(f"不支持的作物数值列: {column}")
+        # 去掉上下界都为空的范围
+        self.ranges = {column: bounds for column, bounds in self.ranges.items()
+                       if bounds[0] is not None or bounds[1] is not None}
+        if self.season_match not in ("any", "all"):
+            raise ValueError(f"不支持的季节匹配方式: {self.season_match}")
+        if self.sort_by not in (None, "asc", "desc"):
+            raise ValueError(f"不支持的排序方向: {self.sort_by}")
+        # 模型传回的整数参数可能是浮点数
+        if self.top_n is not None:
+            self.top_n = int(self.top_n)
+
+    # 季节筛选允许的season_mask取值，未指定季节时为None；"无"只匹配没有季节的作物，
+    # 不含任何季节的其他描述（如"所有"）不匹配任何作物
+    @property
+    def season_masks(self) -> Optional[List[int]]:
+        if self.season is None:
+            return None
+        if self.season.strip() == "无":
+            return [0]
+        match = "any" if means_any_season(self.season) else self.season_match
+        return matching_masks(season_to_mask(self.season), match)
+
+    @property
+    def limit(self) -> Optional[int]:
+        return self.top_n if self.top_n is not None and self.top_n > 0 else None
+
+    @property
+    def order(self) -> Optional[str]:
+        if not self.sort_by or not self.sort_column:
+            return None
+        return "ASC" if self.sort_by == "asc" else "DESC"
+
+    # 查询的结构（不含参数值），结构相同的查询共用同一条SQL和预编译语句
+    def shape(self) -> tuple:
+        season_masks = self.season_masks
+        return (
+            len(season_masks) if season_masks is not None else None,
+            tuple((column, low is not None, high is not None) for column, (low, high) in sorted(self.ranges.items())),
+            self.grow_type is not None,
+            self.sort_column if self.order else None,
+            self.order,
+            self.limit is not None,
+        )
+
+    def params(self) -> list:
+        params = []
+        if self.season is not None:
+            params.extend(self.season_masks)
+        for _, (low, high) in sorted(self.ranges.items()):
+            params.extend(bound for bound in (low, high) if bound is not None)
+        if self.grow_type is not None:
+            params.append(self.grow_type)
+        if self.limit is not None:
+            params.append(self.limit)
+        return params
+
+
+# 根据查询结构生成SQL文本，结果缓存；season_expr为季节位掩码所在的列或计算表达式
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def build_sql(shape: tuple, season_expr: str = "season_mask") -> str:
+    season_count, ranges, has_grow_type, sort_column, order, has_limit = shape
+    query = "SELECT * FROM crops WHERE 1=1"
+
+    if season_count is not None:
+        query += f" AND {season_expr} IN ({', '.join('?' * season_count)})"
+
+    for column, has_min, has_max in ranges:
+        if has_min and has_max:
+            query += f" AND {column} BETWEEN ? AND ?"
+        elif has_min:
+            query += f" AND {column} >= ?"
+        else:
+            query += f" AND {column} <= ?"
+
+    if has_grow_type:
+        query += " AND grow_type = ?"
+
+    if order:
+        # 取值相同时按id排列，结果与内存引擎一致，top_n截断位置确定
+        query += f" ORDER BY {sort_column} {order}, id"
+    else:
+        # 走季节索引时行顺序会变化，未指定排序时固定按数据默认顺序返回
+        query += " ORDER BY id"
+
+    if has_limit:
+        query += " LIMIT ?"
+    return query
+
+
+# 季节筛选方式取决于数据库是否已迁移，先打开连接确定
+def compile_query(query: CropQuery) -> Tuple[str, list]:
+    get_connection()
+    return build_sql(query.shape(), _season_expr), query.params()
+
+
+# 为crops表补充season_mask列、索引和维护触发器，已迁移时不做任何修改；只修改表结构，不依赖模型和向量库
+# 首次打开查询连接时自动运行，setUp.py中也会显式运行
+def migrate_seasons(db_path: str = DB_PATH) -> bool:
+    with sqlite3.connect(db_path) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(crops)")]
+        migrated = "season_mask" not in columns
+        if migrated:
+            conn.execute("ALTER TABLE crops ADD COLUMN season_mask INTEGER NOT NULL DEFAULT 0")
+            conn.execute(f"UPDATE crops SET season_mask = {SEASON_MASK_SQL.format(col='season')}")
+        for statement in SEASON_SCHEMA:
+            conn.execute(statement)
+    return migrated
+
+
+_connection: Optional[sqlite3.Connection] = None
+_connection_lock = threading.RLock()
+# 季节筛选使用的列，未能迁移时为SEASON_LIKE_SQL
+_season_expr = "season_mask"
+
+
+# 进程内长期复用的只读连接，sqlite3按SQL文本缓存预编译语句
+# 打开前先尝试迁移季节字段；数据库不可写导致迁移失败时，季节筛选退回逐行LIKE匹配
+def get_connection() -> sqlite3.Connection:
+    global _connection, _season_expr
+    with _connection_lock:
+        if _connection is None:
+            if os.path.exists(DB_PATH):
+                try:
+                    migrate_seasons(DB_PATH)
+                except sqlite3.Error:
+                    pass
+            uri = pathlib.Path(DB_PATH).as_uri() + "?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                         cached_statements=STATEMENT_CACHE_SIZE)
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(crops)")]
+            _season_expr = "season_mask" if "season_mask" in columns else SEASON_LIKE_SQL
+            connection.row_factory = sqlite3.Row
+            _connection = connection
+        return _connection
+
+
+def execute(sql: str, params: Sequence = ()) -> List[dict]:
+    with _connection_lock:
+        return [dict(row) for row in get_connection().execute(sql, tuple(params))]
+
+
+def run_query(query: CropQuery) -> List[dict]:
+    sql, params = compile_query(query)
+    return execute(sql, params)
+
+
+# 批量查询：多条查询用UNION ALL拼成一条语句，一次执行返回，按查询顺序拆分结果
+def run_queries(queries: Sequence[CropQuery]) -> List[List[dict]]:
+    if not queries:
+        return []
+    parts, params = [], []
+    for i, query in enumerate(queries):
+        sql, query_params = compile_query(query)
+        # 子查询各自保留ORDER BY和LIMIT，UNION ALL按子查询顺序依次输出
+        parts.append(f"SELECT * FROM (SELECT {i} AS query_index, * FROM ({sql}))")
+        params.extend(query_params)
+
+    results: List[List[dict]] = [[] for _ in queries]
+    for row in execute(" UNION ALL ".join(parts), params):
+        results[row.pop('query_index')].append(row)
+    return results
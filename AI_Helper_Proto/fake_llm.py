@@ -0,0 +1,112 @@
+import time
+
+from typing import Dict, List, Optional, Sequence
+
+# 工具调用被禁止（达到轮数上限）或脚本用完时的默认回答
+DEFAULT_ANSWER = "根据已获取的信息作答。"
+
+
+class FakeFunctionCall:
+    def __init__(self, name: str, args: Optional[dict] = None):
+        self.name = name
+        self.args = dict(args or {})
+
+
+class FakePart:
+    def __init__(self, text: str = "", function_call: Optional[FakeFunctionCall] = None):
+        self.text = text
+        self.function_call = function_call
+
+
+class FakeContent:
+    def __init__(self, parts: List[FakePart]):
+        self.role = "model"
+        self.parts = parts
+
+
+class FakeCandidate:
+    def __init__(self, content: FakeContent):
+        self.content = content
+
+
+# 流式响应中的一段
+class FakeChunk:
+    def __init__(self, content: FakeContent):
+        self.candidates = [FakeCandidate(content)]
+
+
+# 与genai的流式响应接口一致：可迭代出各段，resolve后candidates为完整响应
+class FakeResponse:
+    def __init__(self, chunks: List[FakeContent], first_chunk_delay: float = 0.0):
+        self._chunks = chunks
+        self._first_chunk_delay = first_chunk_delay
+        self.candidates = [FakeCandidate(FakeContent([part for chunk in chunks for part in chunk.parts]))]
+
+    def __iter__(self):
+        for i, chunk in enumerate(self._chunks):
+            if i == 0 and self._first_chunk_delay:
+                time.sleep(self._first_chunk_delay)
+            yield FakeChunk(chunk)
+
+    def resolve(self) -> None:
+        pass
+
+    @property
+    def text(self) -> str:
+        return "".join(part.text for part in self.candidates[0].content.parts)
+
+
+# 本地回放模型，接口与genai.GenerativeModel一致，不访问网络
+# turns为每次调用依次返回的内容：{"tool_calls": [{"name": ..., "args": {...}}]}或{"text": ...}；
+# 同时给出text和tool_calls时先输出文字，函数调用在其后的一段中
+# latency模拟每次调用到首段返回的耗时（秒），calls记录每次调用时的消息数和tool_config
+class FakeGenerativeModel:
+    def __init__(self, turns: Sequence[Dict], latency: float = 0.0, chunk_size: int = 16):
+        self.turns = list(turns)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls: List[tuple] = []
+
+    def generate_content(self, messages, stream: bool = False, tool_config=None) -> FakeResponse:
+        self.calls.append((len(messages), tool_config))
+        turn = self.turns.pop(0) if self.turns else {"text": DEFAULT_ANSWER}
+        return build_response(turn, tool_config, self.latency, self.chunk_size)
+
+
+# 按脚本中的一轮内容构造响应；工具调用被禁止时改为默认回答
+def build_response(turn: Dict, tool_config, latency: float, chunk_size: int) -> FakeResponse:
+    tools_disabled = (tool_config or {}).get("function_calling_config", {}).get("mode") == "NONE"
+    if turn.get("tool_calls") and not tools_disabled:
+        parts = [FakePart(function_call=FakeFunctionCall(call["name"], call.get("args")))
+                 for call in turn["tool_calls"]]
+        return FakeResponse(_text_chunks(turn.get("text", ""), chunk_size) + [FakeContent(parts)], latency)
+    return FakeResponse(_text_chunks(turn.get("text") or DEFAULT_ANSWER, chunk_size), latency)
+
+
+def _text_chunks(text: str, chunk_size: int) -> List[FakeContent]:
+    return [FakeContent([FakePart(text[i:i + chunk_size])]) for i in range(0, len(text), chunk_size)]
+
+
+# 按问题回放的无状态模型，可被多个会话和llm_client.LLMClient共享
+# scripts为问题 -> turns；根据用户消息中包含的问题和对话中已有的函数结果轮数选择本次回放的内容
+class ScriptedGenerativeModel:
+    def __init__(self, scripts: Dict[str, Sequence[Dict]], latency: float = 0.0, chunk_size: int = 16):
+        self.scripts = {question: list(turns) for question, turns in scripts.items()}
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    # 一个问题是另一个问题的一部分时，优先匹配较长的问题
+    def _script(self, messages) -> List[Dict]:
+        for message in messages:
+            if isinstance(message, dict) and message.get("role") == "user":
+                text = "".join(part.get("text", "") for part in message["parts"] if isinstance(part, dict))
+                for question in sorted(self.scripts, key=len, reverse=True):
+                    if question in text:
+                        return self.scripts[question]
+        return []
+
+    def generate_content(self, messages, stream: bool = False, tool_config=None) -> FakeResponse:
+        turns = self._script(messages)
+        round_index = sum(1 for message in messages if isinstance(message, dict) and message.get("role") == "function")
+        turn = turns[round_index] if round_index < len(turns) else {"text": DEFAULT_ANSWER}
+        return build_response(turn, tool_config, self.latency, self.chunk_size)
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import chunking
+import model_registry
+import vector_store
+
+# 知识库文件默认位于本模块所在目录，与运行时的工作目录无关
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHROMA_PATH = os.path.join(BASE_DIR, "zuowu.db")
+COLLECTION_NAME = "default"
+# 向量库后端："chroma"为chromadb集合，"flat"为内存映射的平铺向量索引
+VECTOR_BACKEND = "chroma"
+FLAT_INDEX_PATH = os.path.join(BASE_DIR, "zuowu_flat")
+# 平铺索引保存向量的精度，"float16"体积减半，"float32"不损失精度
+FLAT_DTYPE = "float16"
+DOC_FILES = [os.path.join(BASE_DIR, "zuowu.txt")]
+# 攻略文件的根目录，片段的来源记为相对该目录的路径
+DOCS_ROOT = BASE_DIR
+
+# 每批向量化的片段数
+EMBED_BATCH_SIZE = 32
+# 每次批量写入向量库的片段数
+WRITE_BATCH_SIZE = 256
+
+
+# 分片方法：先按空行切分段落，再用embedding模型的分词器把长段落切成token数受限、相邻重叠的片段
+def split_into_chunks(doc_file: str, max_tokens: int = chunking.CHUNK_MAX_TOKENS,
+                      overlap: int = chunking.CHUNK_OVERLAP_TOKENS) -> List[chunking.Chunk]:
+    with open(doc_file, 'r', encoding='utf-8') as file:
+        content = file.read()
+    tokenizer = model_registry.get_tokenizer()
+    # 片段加上[CLS]/[SEP]后不能超过分词器的最大长度
+    max_tokens = min(max_tokens, tokenizer.model_max_length - 2)
+    return chunking.chunk_text(content, tokenizer, max_tokens, overlap)
+
+
+# 片段内容哈希，作为增量更新时判断片段是否变化的依据
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+# 攻略文件的来源标识：相对DOCS_ROOT的路径（统一为/分隔），不同目录下的同名文件不会相互覆盖；
+# 与DOCS_ROOT不在同一驱动器时使用绝对路径
+def document_source(doc_file: str) -> str:
+    path = os.path.abspath(doc_file)
+    try:
+        path = os.path.relpath(path, DOCS_ROOT)
+    except ValueError:
+        pass
+    return path.replace(os.sep, "/")
+
+
+# 根据来源文件和内容哈希生成片段id，同一文件内重复片段追加序号
+def build_chunk_ids(source: str, chunks: List[str]) -> List[str]:
+    seen: Dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        digest = chunk_hash(chunk)
+        count = seen.get(digest, 0)
+        seen[digest] = count + 1
+        ids.append(f"{source}:{digest[:32]}:{count}")
+    return ids
+
+
+# 片段向量转化方法
+def embed_chunk(chunk: str) -> List[float]:
+    embedding = model_registry.get_embedding_model().encode(chunk)
+    return embedding.tolist()
+
+
+# 按长度排序后切分批次，同批片段长度相近以减少padding
+def make_length_batches(chunks: List[str], batch_size: int) -> List[List[int]]:
+    order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+# 子进程初始化：每个进程加载一份模型，并平分CPU线程避免相互争抢
+def _init_worker(threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(threads)
+    model_registry.get_embedding_model()
+
+
+def _encode_batch(batch: List[str]) -> List[List[float]]:
+    embeddings = model_registry.get_embedding_model().encode(batch, batch_size=len(batch))
+    return embeddings.tolist()
+
+
+# 批量向量化：按长度分组、按批编码，可选多进程；逐批产出(片段下标, 向量)
+def iter_embedding_batches(chunks: List[str], batch_size: int = EMBED_BATCH_SIZE,
+                           workers: int = 1) -> Iterator[Tuple[List[int], List[List[float]]]]:
+    batches = make_length_batches(chunks, batch_size)
+    if workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            yield batch, _encode_batch([chunks[i] for i in batch])
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(threads,)) as executor:
+        results = executor.map(_encode_batch, [[chunks[i] for i in batch] for batch in batches])
+        for batch, embeddings in zip(batches, results):
+            yield batch, embeddings
+
+
+# 批量向量化，返回结果与输入顺序一致
+def embed_chunks(chunks: List[str], batch_size: int = EMBED_BATCH_SIZE, workers: int = 1) -> List[List[float]]:
+    embeddings: List[List[float]] = [[] for _ in chunks]
+    for batch, batch_embeddings in iter_embedding_batches(chunks, batch_size, workers):
+        for i, embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+    return embeddings
+
+
+# 建立向量知识库
+chromadb_client = None
+chromadb_collection = None
+
+
+def get_collection():
+    global chromadb_client, chromadb_collection
+    if chromadb_collection is None:
+        # chromadb导入较慢，首次连接时才导入
+        import chromadb
+
+        chromadb_client = chromadb.PersistentClient(CHROMA_PATH)
+        # 在chromadb中创建collection表
+        chromadb_collection = chromadb_client.get_or_create_collection(name=COLLECTION_NAME)
+    return chromadb_collection
+
+
+vector_stores: Dict[str, object] = {}
+
+
+# 按后端取向量库，每个后端在进程内只打开一次
+def get_store(backend: Optional[str] = None):
+    backend = backend or VECTOR_BACKEND
+    if backend not in vector_stores:
+        if backend == "chroma":
+            collection = get_collection()
+            vector_stores[backend] = vector_store.ChromaVectorStore(collection, chromadb_client, CHROMA_PATH)
+        elif backend == "flat":
+            vector_stores[backend] = vector_store.FlatVectorStore(FLAT_INDEX_PATH, FLAT_DTYPE)
+        else:
+            raise ValueError(f"未知的向量库后端: {backend}")
+    return vector_stores[backend]
+
+
+# 片段在向量库中的元数据：来源、内容哈希、所属作物、段内序号和token数
+def chunk_metadata(chunk: chunking.Chunk, source: str) -> Dict[str, object]:
+    return {"source": source, "hash": chunk_hash(chunk.text), **chunk.metadata()}
+
+
+# 将片段写入向量库，id已存在时覆盖；store默认为VECTOR_BACKEND对应的向量库
+def save_embeddings(ids: List[str], chunks: List[chunking.Chunk], embeddings: List[List[float]], source: str,
+                    store=None) -> None:
+    if not ids:
+        return
+    (store or get_store()).upsert(
+        ids=ids,
+        documents=[chunk.text for chunk in chunks],
+        embeddings=embeddings,
+        metadatas=[chunk_metadata(chunk, source) for chunk in chunks]
+    )
+
+
+# 删除知识库中没有来源信息的旧版片段（旧版以0..N为id一次性写入）
+def delete_legacy_chunks(backend: Optional[str] = None) -> int:
+    store = get_store(backend)
+    existing = store.get()
+    legacy_ids = [chunk_id for chunk_id, metadata in zip(existing['ids'], existing['metadatas'])
+                  if not metadata or "hash" not in metadata]
+    store.delete(legacy_ids)
+    store.flush()
+    return len(legacy_ids)
+
+
+# 增量导入单个攻略文件：只对新增或修改的片段做向量化，并删除已消失的片段
+# 向量化结果按批流式写入向量库，不必等待全部片段编码完成；内容未变但元数据变化的片段只更新元数据
+def sync_document(doc_file: str, batch_size: int = EMBED_BATCH_SIZE, workers: int = 1,
+                  max_tokens: int = chunking.CHUNK_MAX_TOKENS, overlap: int = chunking.CHUNK_OVERLAP_TOKENS,
+                  backend: Optional[str] = None) -> Dict[str, float]:
+    store = get_store(backend)
+    source = document_source(doc_file)
+    chunks = split_into_chunks(doc_file, max_tokens, overlap)
+    ids = build_chunk_ids(source, [chunk.text for chunk in chunks])
+
+    existing = store.get(source)
+    existing_metadata = dict(zip(existing['ids'], existing['metadatas']))
+    wanted = dict(zip(ids, chunks))
+
+    new_ids = [chunk_id for chunk_id in ids if chunk_id not in existing_metadata]
+    stale_ids = [chunk_id for chunk_id in existing_metadata if chunk_id not in wanted]
+    new_chunks = [wanted[chunk_id] for chunk_id in new_ids]
+    retagged_ids = [chunk_id for chunk_id in ids if chunk_id in existing_metadata
+                    and existing_metadata[chunk_id] != chunk_metadata(wanted[chunk_id], source)]
+
+    write_size = min(WRITE_BATCH_SIZE, store.max_batch_size())
+    pending_ids, pending_chunks, pending_embeddings = [], [], []
+    start = time.perf_counter()
+    for batch, batch_embeddings in iter_embedding_batches([chunk.text for chunk in new_chunks], batch_size, workers):
+        pending_ids.extend(new_ids[i] for i in batch)
+        pending_chunks.extend(new_chunks[i] for i in batch)
+        pending_embeddings.extend(batch_embeddings)
+        if len(pending_ids) >= write_size:
+            save_embeddings(pending_ids, pending_chunks, pending_embeddings, source, store)
+            pending_ids, pending_chunks, pending_embeddings = [], [], []
+    save_embeddings(pending_ids, pending_chunks, pending_embeddings, source, store)
+    elapsed = time.perf_counter() - start
+
+    store.delete(stale_ids)
+    for begin in range(0, len(retagged_ids), write_size):
+        batch_ids = retagged_ids[begin:begin + write_size]
+        store.update_metadata(batch_ids, [chunk_metadata(wanted[chunk_id], source) for chunk_id in batch_ids])
+    store.flush()
+
+    return {
+        "total": len(ids),
+        "embedded": len(new_ids),
+        "deleted": len(stale_ids),
+        "retagged": len(retagged_ids),
+        "max_tokens": max((chunk.tokens for chunk in chunks), default=0),
+        "chunks_per_sec": len(new_ids) / elapsed if new_ids and elapsed > 0 else 0.0,
+    }
+
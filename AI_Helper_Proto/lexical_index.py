@@ -0,0 +1,89 @@
+import math
+import re
+
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import caches
+
+# BM25参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 连续的汉字串、连续的字母数字串
+_TOKEN_PATTERN = re.compile(r"[一-鿿]+|[0-9a-z]+")
+
+
+# 分词：汉字串取相邻两字的二元组（作物名多为2~4字，二元组能精确命中"草莓"、"上古水果"），
+# 单个汉字保留为单字，字母数字串整体作为一个词
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(caches.normalize_query(text)):
+        if len(run) == 1 or not ("一" <= run[0] <= "鿿"):
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+# 基于字二元组的本地BM25倒排索引
+class LexicalIndex:
+    def __init__(self, ids: Sequence[str], documents: Sequence[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self._by_id = dict(zip(self.ids, self.documents))
+        self.k1 = k1
+        self.b = b
+        # 词 -> [(文档下标, 词频)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = []
+        for doc_index, document in enumerate(self.documents):
+            counts = Counter(tokenize(document))
+            lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self.postings[token].append((doc_index, tf))
+        self.doc_lengths = np.array(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if lengths else 0.0
+
+    # 从向量库构建，文档id与向量库保持一致
+    @classmethod
+    def from_store(cls, store) -> "LexicalIndex":
+        data = store.get()
+        return cls(data['ids'], data['documents'])
+
+    def _idf(self, token: str) -> float:
+        df = len(self.postings.get(token, ()))
+        n = len(self.documents)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    # 返回得分最高的top_k个(文档id, 得分)，只包含至少命中一个词的文档
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        if not self.documents:
+            return []
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avg_length, 1e-6))
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            doc_indices = np.fromiter((doc_index for doc_index, _ in postings), dtype=np.int64, count=len(postings))
+            tfs = np.fromiter((tf for _, tf in postings), dtype=np.float32, count=len(postings))
+            scores[doc_indices] += self._idf(token) * tfs * (self.k1 + 1) / (tfs + norm[doc_indices])
+
+        hits = np.flatnonzero(scores > 0)
+        top = hits[np.argsort(-scores[hits], kind='stable')][:top_k]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def get_document(self, doc_id: str) -> str:
+        return self._by_id[doc_id]
+
+
+# 倒数排名融合：每个结果列表中排名为r的文档得分1/(k+r)，多列表累加后排序
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    scores: Dict[str, float] = defaultdict(float)
+    for ranked in ranked_lists:
+        for rank, doc_id in enumerate(ranked, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import random
+import threading
+import time
+import weakref
+
+from typing import Callable, Dict, Optional
+
+import tracing
+
+# 进程内同时进行的模型请求数上限，流式请求在响应读完前一直占用名额
+LLM_MAX_CONCURRENCY = 8
+# 可重试错误的最大重试次数，以及退避等待的基数和上限（秒）；实际等待在0到min(上限, 基数*2^n)间随机
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF_BASE = 0.5
+LLM_BACKOFF_MAX = 8.0
+# 视为临时性错误的异常类名（google.api_core.exceptions中的限流、超时和服务端错误），按类名判断以免导入google.api_core
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "DeadlineExceeded", "GatewayTimeout"}
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in RETRYABLE_ERRORS
+
+
+# 可被多个调用方同时读取的流式响应：各调用方各自从头迭代，底层响应只读取一次，读到的段缓存在内存中
+# 底层响应读完、出错或本对象被回收时调用一次on_done
+class SharedResponse:
+    def __init__(self, response, on_done: Callable[[], None]):
+        self._response = response
+        self._source = iter(response)
+        self._chunks = []
+        self._done = False
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, on_done)
+
+    # 确保第index段已读到，底层响应已读完时返回False
+    def _fetch(self, index: int) -> bool:
+        with self._lock:
+            while len(self._chunks) <= index and not self._done:
+                try:
+                    self._chunks.append(next(self._source))
+                except StopIteration:
+                    self._done = True
+                except Exception as e:
+                    self._error = e
+                    self._done = True
+            if self._done:
+                self._finalizer()
+            if index < len(self._chunks):
+                return True
+            if self._error is not None:
+                raise self._error
+            return False
+
+    def __iter__(self):
+        index = 0
+        while self._fetch(index):
+            yield self._chunks[index]
+            index += 1
+
+    def resolve(self) -> None:
+        for _ in self:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+# 一次进行中的请求；流式请求只保存弱引用，调用方全部放弃读取后共享的响应可被回收
+class _Flight:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.response = None
+        self.response_ref = None
+        self.error: Optional[Exception] = None
+
+    def result(self):
+        return self.response_ref() if self.response_ref is not None else self.response
+
+
+# 进程内长期复用的模型客户端，接口与genai.GenerativeModel的generate_content一致：
+# 模型对象只创建一次；内容完全相同的请求同时进行时合并为一次调用（single-flight）；
+# 临时性错误按带随机抖动的指数退避重试；同时进行的请求数受max_concurrency限制。
+# model_factory返回实际的模型，测试中可替换为fake_llm中的本地回放模型
+class LLMClient:
+    def __init__(self, model_factory: Callable, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.model_factory = model_factory
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._inflight: Dict[str, _Flight] = {}
+        self._inflight_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.model_factory()
+        return self._model
+
+    @staticmethod
+    def _key(messages, stream: bool, tool_config) -> str:
+        payload = json.dumps([messages, stream, tool_config], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def generate_content(self, messages, stream: bool = False, tool_config=None):
+        key = self._key(messages, stream, tool_config)
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.ready.wait()
+            if flight.error is not None:
+                raise flight.error
+            response = flight.result()
+            if response is not None:
+                tracing.set_attributes(coalesced=True)
+                tracing.count("aihelper_llm_requests_total", result="coalesced")
+                return response
+            # 共享的流式响应已被全部调用方放弃，单独发起请求
+            return self._request(messages, stream, tool_config)
+
+        try:
+            response = self._request(messages, stream, tool_config, on_done=lambda: self._forget(key, flight))
+        except Exception as e:
+            flight.error = e
+            self._forget(key, flight)
+            flight.ready.set()
+            raise
+        if stream:
+            flight.response_ref = weakref.ref(response)
+        else:
+            flight.response = response
+            self._forget(key, flight)
+        flight.ready.set()
+        return response
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        with self._inflight_lock:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    # 占用一个并发名额发起请求；流式响应读完后才归还名额并调用on_done
+    def _request(self, messages, stream: bool, tool_config, on_done: Optional[Callable[[], None]] = None):
+        self._slots.acquire()
+        try:
+            response = self._call_with_retry(messages, stream, tool_config)
+        except BaseException:
+            self._slots.release()
+            raise
+        if not stream:
+            self._slots.release()
+            return response
+
+        def done():
+            self._slots.release()
+            if on_done is not None:
+                on_done()
+        return SharedResponse(response, done)
+
+    def _call_with_retry(self, messages, stream: bool, tool_config):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.model.generate_content(messages, stream=stream, tool_config=tool_config)
+                tracing.count("aihelper_llm_requests_total", result="ok")
+                return response
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    tracing.count("aihelper_llm_requests_total", result="error")
+                    raise
+                tracing.set_attributes(retries=attempt + 1)
+                tracing.count("aihelper_llm_retries_total", error=type(e).__name__)
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
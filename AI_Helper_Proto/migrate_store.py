@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+import knowledge_base
+
+
+# 把源向量库中的全部片段（id、内容、元数据、向量）按批写入目标向量库，并删除目标中源已没有的片段
+def migrate(source_backend: str, target_backend: str) -> dict:
+    source = knowledge_base.get_store(source_backend)
+    target = knowledge_base.get_store(target_backend)
+    start = time.perf_counter()
+
+    data = source.get(embeddings=True)
+    ids = data['ids']
+    embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+    batch_size = target.max_batch_size()
+    for begin in range(0, len(ids), batch_size):
+        end = begin + batch_size
+        target.upsert(ids[begin:end], data['documents'][begin:end], embeddings[begin:end].tolist(),
+                      data['metadatas'][begin:end])
+
+    wanted = set(ids)
+    stale_ids = [chunk_id for chunk_id in target.get()['ids'] if chunk_id not in wanted]
+    target.delete(stale_ids)
+    target.flush()
+
+    return {
+        "copied": len(ids),
+        "deleted": len(stale_ids),
+        "total": target.count(),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# 抽取部分片段向量作为提问，检查两个向量库召回的前k个片段是否一致
+def verify(source_backend: str, target_backend: str, samples: int, top_k: int) -> float:
+    source = knowledge_base.get_store(source_backend)
+    target = knowledge_base.get_store(target_backend)
+    data = source.get(embeddings=True)
+    embeddings = np.asarray(data['embeddings'], dtype=np.float32)
+    if len(embeddings) == 0:
+        return 1.0
+    rows = np.linspace(0, len(embeddings) - 1, min(samples, len(embeddings))).astype(int)
+    overlaps = []
+    for row in rows:
+        expected = source.query(embeddings[row].tolist(), top_k)[0]
+        actual = target.query(embeddings[row].tolist(), top_k)[0]
+        overlaps.append(len(set(expected) & set(actual)) / len(expected))
+    return float(np.mean(overlaps))
+
+
+# 向量库迁移入口：python migrate_store.py --from chroma --to flat [--dtype float32]
+def main() -> None:
+    parser = argparse.ArgumentParser(description="在chromadb和平铺向量索引之间迁移知识库")
+    parser.add_argument("--from", dest="source", choices=["chroma", "flat"], default="chroma", help="源向量库")
+    parser.add_argument("--to", dest="target", choices=["chroma", "flat"], default="flat", help="目标向量库")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default=knowledge_base.FLAT_DTYPE,
+                        help="平铺索引保存向量的精度")
+    parser.add_argument("--samples", type=int, default=20, help="迁移后用于核对召回结果的提问数，为0时不核对")
+    parser.add_argument("--top-k", type=int, default=10, help="核对召回结果时比较的片段数")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("源向量库和目标向量库相同")
+
+    knowledge_base.FLAT_DTYPE = args.dtype
+    stats = migrate(args.source, args.target)
+    print(f"{args.source} -> {args.target}: 写入{stats['copied']}个片段，删除{stats['deleted']}个，"
+          f"目标共{stats['total']}个，耗时{stats['seconds']:.1f}秒")
+    if args.samples > 0:
+        overlap = verify(args.source, args.target, args.samples, args.top_k)
+        print(f"召回前{args.top_k}个片段的重合率: {overlap:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import platform
+import threading
+
+from typing import Any, Callable, Dict, Optional
+
+import caches
+
+EMBEDDING_MODEL_NAME = "shibing624/text2vec-base-chinese"
+CROSS_ENCODER_MODEL_NAME = 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'
+
+# 推理后端：torch为原始的全精度PyTorch模型，onnx为int8动态量化后的ONNX模型（CPU推理）
+# 切换前可运行python check_backend.py确认两者的召回和重排结果一致
+MODEL_BACKEND = "torch"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 导出的ONNX模型缓存目录，每个模型只导出、量化一次
+ONNX_CACHE_DIR = os.path.join(BASE_DIR, "onnx_models")
+# 动态量化针对的指令集，ARM机器使用arm64，其余使用avx2
+ONNX_QUANTIZATION = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+ONNX_PROVIDER = "CPUExecutionProvider"
+
+# 进程级模型注册表：每个模型/缓存在一个进程内只加载一次，由app、ask.py和批处理工具共享
+_registry: Dict[str, Any] = {}
+# 加载缓存时会嵌套加载其依赖的模型，因此使用可重入锁
+_lock = threading.RLock()
+
+
+def get_or_load(key: str, loader: Callable[[], Any]) -> Any:
+    instance = _registry.get(key)
+    if instance is None:
+        with _lock:
+            instance = _registry.get(key)
+            if instance is None:
+                instance = loader()
+                _registry[key] = instance
+    return instance
+
+
+# 量化模型在缓存目录中的相对路径
+def _quantized_file() -> str:
+    return os.path.join("onnx", f"model_qint8_{ONNX_QUANTIZATION}.onnx")
+
+
+# 加载int8量化的ONNX模型；缓存目录中没有时先从原模型导出ONNX并量化，保存后再加载
+def load_quantized_onnx(model_class, model_name: str):
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model_dir = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "--"))
+    model_kwargs = {"provider": ONNX_PROVIDER}
+    if not os.path.exists(os.path.join(model_dir, _quantized_file())):
+        # backend="onnx"加载hub上的模型时会自动导出全精度ONNX
+        model = model_class(model_name, backend="onnx", model_kwargs=model_kwargs)
+        model.save_pretrained(model_dir)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, model_dir)
+    return model_class(model_dir, backend="onnx", model_kwargs={**model_kwargs, "file_name": _quantized_file()})
+
+
+# 加载的模型带有model_id（模型名:推理后端），打分缓存据此区分不同后端的打分
+def _load_model(model_class, model_name: str, backend: str):
+    if backend == "onnx":
+        model = load_quantized_onnx(model_class, model_name)
+    elif backend == "torch":
+        model = model_class(model_name)
+    else:
+        raise ValueError(f"不支持的推理后端: {backend}")
+    model.model_id = f"{model_name}:{backend}"
+    return model
+
+
+# backend为空时使用MODEL_BACKEND；不同后端的模型分别注册，可在同一进程内对比
+def get_embedding_model(backend: Optional[str] = None):
+    backend = backend or MODEL_BACKEND
+
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return _load_model(SentenceTransformer, EMBEDDING_MODEL_NAME, backend)
+    return get_or_load(f"embedding_model:{backend}", load)
+
+
+# embedding模型的分词器，切分片段时只需分词器，不必加载整个模型
+def get_tokenizer():
+    def load():
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+    return get_or_load("tokenizer", load)
+
+
+def get_cross_encoder(backend: Optional[str] = None):
+    backend = backend or MODEL_BACKEND
+
+    def load():
+        from sentence_transformers import CrossEncoder
+        return _load_model(CrossEncoder, CROSS_ENCODER_MODEL_NAME, backend)
+    return get_or_load(f"cross_encoder:{backend}", load)
+
+
+# 提问向量缓存，位于embedding模型之前
+def get_query_cache():
+    return get_or_load("query_cache", lambda: caches.QueryEmbeddingCache(get_embedding_model()))
+
+
+# 重排打分缓存
+def get_score_cache():
+    return get_or_load("score_cache", lambda: caches.RerankScoreCache())
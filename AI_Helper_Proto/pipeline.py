@@ -0,0 +1,283 @@
+import itertools
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+import context
+import llm_client
+import retrieval
+import tools
+import tracing
+
+# 回答使用的模型
+MODEL_NAME = "gemini-2.5-flash"
+
+# 是否使用自适应重排（召回可信时跳过重排，否则分批打分并在结果稳定或超出时间预算时提前结束）
+ADAPTIVE_RERANK = True
+
+# 单轮内并发执行工具的线程数
+TOOL_WORKERS = 4
+# 每个问题最多进行的工具调用轮数，超出后要求模型直接作答
+MAX_TOOL_ROUNDS = 3
+
+# 是否在第一次模型调用的同时预先执行RAG召回和重排
+SPECULATIVE_RAG = True
+# 预取RAG使用的线程数
+PREFETCH_WORKERS = 2
+
+# 是否在送入模型前整理RAG片段（去重、按token预算保留与提问最相关的句子、紧凑排版），关闭时直接返回片段列表
+CONTEXT_COMPRESSION = True
+
+PROMPT = """你是一位星露谷农作物种植助手，请根据用户问题和提供片段中的有用信息生成准确回答。回答格式请尽量简洁，美观。
+    不要编造信息，请从工具库中选择合适的工具来获取信息，可以同时调用多个工具。若无需其他信息，则直接回答。若所获信息无法解决问题，则直接说明无法解决。"""
+
+
+# 配置Gemini API密钥；genai导入较慢，首次使用时才导入
+def configure_genai(api_key: Optional[str]) -> None:
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+
+
+# 带全部工具声明的Gemini模型
+def create_model():
+    import google.generativeai as genai
+
+    return genai.GenerativeModel(MODEL_NAME, tools=tools.TOOLS_LIST)
+
+
+# 进程内共享的模型客户端，所有会话复用同一个模型对象
+default_client = llm_client.LLMClient(create_model)
+
+
+# 默认的回答模型
+def default_model_factory():
+    return default_client
+
+
+# 取出响应（或流式响应的某一段）中的全部函数调用
+def get_parts(response) -> list:
+    try:
+        return list(response.candidates[0].content.parts)
+    except (AttributeError, IndexError, TypeError):
+        return []
+
+
+def get_function_calls(response) -> list:
+    return [part.function_call for part in get_parts(response) if part.function_call]
+
+
+# 逐段产出流式响应中的文本，并记录首个token耗时
+def stream_text(chunks, stats: dict, start: float) -> Iterator[str]:
+    for chunk in chunks:
+        try:
+            parts = chunk.candidates[0].content.parts
+        except (AttributeError, IndexError):
+            continue
+        for part in parts:
+            if part.text:
+                if "ttft" not in stats:
+                    stats["ttft"] = time.perf_counter() - start
+                yield part.text
+    stats["total"] = time.perf_counter() - start
+
+
+# 记录一次模型调用的提问和回答token数
+def record_usage(llm_span: tracing.Span, response, stats: dict) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_token_count or 0
+    response_tokens = usage.candidates_token_count or 0
+    llm_span.set(prompt_tokens=prompt_tokens, response_tokens=response_tokens)
+    stats["prompt_tokens"] = stats.get("prompt_tokens", 0) + prompt_tokens
+    stats["response_tokens"] = stats.get("response_tokens", 0) + response_tokens
+    tracing.count("aihelper_llm_tokens_total", prompt_tokens, kind="prompt")
+    tracing.count("aihelper_llm_tokens_total", response_tokens, kind="response")
+
+
+def call_tool(tool_call):
+    function_name = tool_call.name
+    args = {k: v for k, v in tool_call.args.items()}
+
+    # 函数名到实际函数的映射
+    if function_name in tools.TOOL_FUNCTIONS:
+        return tools.TOOL_FUNCTIONS[function_name](**args)
+    raise ValueError(f"未知的工具: {function_name}")
+
+
+# 回答流程：召回重排、工具调用循环和回答缓存，不依赖streamlit，app、基准测试和批处理工具共用
+# model_factory返回与genai.GenerativeModel接口一致的模型，默认为共享的llm_client.LLMClient，基准测试中替换为本地回放模型
+class AnswerPipeline:
+    def __init__(self, store, embedding_model, cross_encoder, score_cache=None, keyword_index=None,
+                 answers=None, model_factory: Callable = default_model_factory,
+                 tool_executor: Optional[ThreadPoolExecutor] = None,
+                 prefetch_executor: Optional[ThreadPoolExecutor] = None,
+                 context_builder: Optional[context.ContextBuilder] = None):
+        self.store = store
+        self.embedding_model = embedding_model
+        self.cross_encoder = cross_encoder
+        self.score_cache = score_cache
+        self.keyword_index = keyword_index
+        self.answers = answers
+        self.model_factory = model_factory
+        self.tool_executor = tool_executor or ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+        self.prefetch_executor = prefetch_executor or ThreadPoolExecutor(max_workers=PREFETCH_WORKERS,
+                                                                         thread_name_prefix="rag-prefetch")
+        self.context_builder = context_builder or context.ContextBuilder(embedding_model)
+
+    # stats用于记录本次重排实际走的路径
+    def retrieve_and_rerank(self, query: str, top_k1=10, top_k2=4, stats: dict = None):
+        with tracing.span("retrieve_and_rerank", top_k1=top_k1, top_k2=top_k2,
+                          hybrid=self.keyword_index is not None) as span:
+            chunks = retrieval.retrieve_and_rerank(query, self.store, self.embedding_model, self.cross_encoder,
+                                                   top_k1, top_k2, self.score_cache, self.keyword_index,
+                                                   adaptive=ADAPTIVE_RERANK, stats=stats)
+            span.set(chunks=len(chunks), chunk_chars=sum(len(chunk) for chunk in chunks))
+            return chunks
+
+    # RAG工具返回给模型的内容
+    def rag_content(self, query: str, chunks: list, stats: dict = None):
+        if not CONTEXT_COMPRESSION:
+            return chunks
+        return self.context_builder.build(query, chunks, stats)
+
+    # 预取的统计（重排路径、上下文token数）先记在单独的字典中，RAG工具实际使用预取结果时才并入本次回答的stats
+    def _prefetch(self, query: str, chunks: Optional[list] = None):
+        prefetch_stats = {}
+        with tracing.span("rag_prefetch"):
+            if chunks is None:
+                chunks = self.retrieve_and_rerank(query, stats=prefetch_stats)
+            return self.rag_content(query, chunks, prefetch_stats), prefetch_stats
+
+    # 执行单个工具调用，RAG检索与SQL工具同等对待；出错时把错误交给模型处理
+    # rag_future为预取并整理好的RAG内容，存在时直接使用
+    def run_tool(self, tool_call, query: str, rag_future=None, stats: dict = None) -> dict:
+        tracing.count("aihelper_tool_calls_total", tool=tool_call.name)
+        with tracing.span("call_tool", tool=tool_call.name) as span:
+            try:
+                if tool_call.name == "RAGCalling":
+                    # 执行召回、重排过程
+                    span.set(prefetched=rag_future is not None)
+                    if rag_future is not None:
+                        content, prefetch_stats = rag_future.result()
+                        if stats is not None:
+                            stats.update(prefetch_stats)
+                        return {"content": content}
+                    return {"content": self.rag_content(query, self.retrieve_and_rerank(query, stats=stats), stats)}
+
+                span.set(args=dict(tool_call.args))
+                return {"content": call_tool(tool_call)}
+            except Exception as e:
+                span.set(error=f"{type(e).__name__}: {e}")
+                if stats is not None:
+                    stats["tool_errors"] = stats.get("tool_errors", 0) + 1
+                return {"error": str(e)}
+
+    # 在线程池中并发执行本轮全部工具调用，返回按调用顺序排列的函数响应
+    def run_tools(self, tool_calls, query: str, rag_future=None, stats: dict = None) -> list:
+        run = tracing.bind(lambda tool_call: self.run_tool(tool_call, query, rag_future, stats))
+        outputs = self.tool_executor.map(run, tool_calls)
+        return [
+            {"function_response": {"name": tool_call.name, "response": output}}
+            for tool_call, output in zip(tool_calls, outputs)
+        ]
+
+    # 流式回答方法：模型每轮可请求多个工具，全部并发执行后在一条消息中返回结果，
+    # 直到模型直接作答或达到MAX_TOOL_ROUNDS；直接回答、函数结果回答和RAG回答均逐段产出文本
+    # 整个回答过程记录为一个追踪，stats["trace_id"]为其id；rag_chunks为已算好的召回重排结果，传入时只做上下文整理
+    def generate_answer_stream(self, query: str, stats: dict = None,
+                               rag_chunks: Optional[list] = None) -> Iterator[str]:
+        stats = {} if stats is None else stats
+        stats["llm_calls"] = 0
+        stats["tool_calls"] = 0
+        start = time.perf_counter()
+
+        with tracing.span("generate_answer", query_chars=len(query)) as root:
+            stats["trace_id"] = root.trace_id
+
+            # 语义相近的问题已回答过时直接返回缓存的回答
+            if self.answers is not None:
+                cached_answer = self.answers.lookup(query)
+                stats["answer_cache"] = "hit" if cached_answer is not None else "miss"
+                root.set(answer_cache=stats["answer_cache"])
+                tracing.count("aihelper_cache_total", cache="answer", result=stats["answer_cache"])
+                if cached_answer is not None:
+                    stats["ttft"] = stats["total"] = time.perf_counter() - start
+                    yield cached_answer
+                    return
+
+            # 构造第一轮消息
+            messages = [
+                {"role": "user", "parts": [{"text": PROMPT}]},
+                {"role": "user", "parts": [{"text": f"用户问题: {query}\n\n"}]}
+            ]
+
+            # 与第一次模型调用并行地预取并整理RAG片段，模型选择RAG时直接使用，否则丢弃
+            if rag_chunks is not None or SPECULATIVE_RAG:
+                rag_future = self.prefetch_executor.submit(tracing.bind(self._prefetch), query, rag_chunks)
+            else:
+                rag_future = None
+            pieces = []
+            try:
+                for piece in self._answer_rounds(query, messages, stats, start, rag_future):
+                    pieces.append(piece)
+                    yield piece
+                # 工具出错时模型依据错误信息作答，这样的回答不缓存
+                if self.answers is not None and not stats.get("tool_errors"):
+                    self.answers.store(query, "".join(pieces))
+            finally:
+                if rag_future is not None:
+                    stats["rag_prefetch"] = "used" if stats.get("rag_used") else "discarded"
+                    rag_future.cancel()
+                root.set(answer_chars=sum(len(piece) for piece in pieces),
+                         **{key: stats[key] for key in ("llm_calls", "tool_calls", "rag_prefetch", "prompt_tokens",
+                                                         "response_tokens", "context_tokens_raw", "context_tokens")
+                            if key in stats})
+                if "ttft" in stats:
+                    root.set(ttft_ms=stats["ttft"] * 1000)
+
+    # 工具调用循环
+    def _answer_rounds(self, query: str, messages: list, stats: dict, start: float, rag_future) -> Iterator[str]:
+        model = self.model_factory()
+        for round_index in range(MAX_TOOL_ROUNDS + 1):
+            # 达到轮数上限后禁止继续调用工具
+            tool_config = {"function_calling_config": {"mode": "NONE"}} if round_index == MAX_TOOL_ROUNDS else None
+
+            with tracing.span("llm_call", round=round_index, tools_enabled=tool_config is None) as llm_span:
+                # 获取响应；跳过没有任何part的段，以第一个有内容的段判断是直接回答还是函数调用
+                response = model.generate_content(messages, stream=True, tool_config=tool_config)
+                stats["llm_calls"] += 1
+                chunks = iter(response)
+                leading = []
+                for chunk in chunks:
+                    leading.append(chunk)
+                    if get_parts(chunk):
+                        break
+
+                if leading and get_function_calls(leading[-1]):
+                    # 取完整响应中的全部函数调用
+                    response.resolve()
+                    tool_calls = get_function_calls(response)
+                    record_usage(llm_span, response, stats)
+                else:
+                    # 流式返回文字；模型可能先说一段话再调用工具，读完后以完整响应中的函数调用为准
+                    yield from stream_text(itertools.chain(leading, chunks), stats, start)
+                    tool_calls = get_function_calls(response)
+                    record_usage(llm_span, response, stats)
+                    if not tool_calls:
+                        return
+                llm_span.set(function_calls=[tool_call.name for tool_call in tool_calls])
+
+            stats["tool_calls"] += len(tool_calls)
+            if any(tool_call.name == "RAGCalling" for tool_call in tool_calls):
+                stats["rag_used"] = True
+
+            # 模型的函数调用和全部函数结果依次加入对话
+            messages.append(response.candidates[0].content)
+            messages.append({"role": "function", "parts": self.run_tools(tool_calls, query, rag_future, stats)})
+
+    # 非流式回答方法
+    def generate_answer(self, query: str, stats: dict = None, rag_chunks: Optional[list] = None) -> str:
+        return "".join(self.generate_answer_stream(query, stats, rag_chunks))
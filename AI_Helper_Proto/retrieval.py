@@ -0,0 +1,209 @@
+import math
+import time
+
+from typing import List, Optional, Tuple
+
+import lexical_index
+import tracing
+
+# 混合召回时向量召回和关键词召回各取的候选数
+DENSE_TOP_K = 10
+LEXICAL_TOP_K = 10
+# 融合后送入cross-encoder重排的候选数
+RERANK_CANDIDATES = 6
+# 自适应重排时融合后的候选数：比top_k多出至少两批，前top_k稳定时才有未打分的候选可以省掉
+ADAPTIVE_RERANK_CANDIDATES = 8
+
+# 自适应重排：候选第1名的向量距离比其余候选中最近的一个小出该相对差时，认为召回足够可信，跳过cross-encoder
+# 相对差的含义随距离度量而变，按向量库的distance_metric分别设置；没有设置的度量从不跳过
+RERANK_SKIP_MARGIN = {
+    # 未归一化向量上的平方l2距离（chromadb默认），向量长度的差异也计入距离
+    "l2": 0.2,
+    # 以hnsw:space=cosine创建的chromadb集合，距离为1-余弦相似度
+    "cosine": 0.2,
+}
+# 自适应重排每批打分的候选数
+RERANK_BATCH_SIZE = 2
+# 单次提问重排的时间预算（毫秒），用完后以已打分的结果为准
+RERANK_BUDGET_MS = 150
+# 批量重排时每次送入cross-encoder的(提问, 片段)组合数
+CROSS_ENCODER_BATCH_SIZE = 32
+
+
+# 向量召回，返回片段id、片段和距离；store为vector_store中任一种向量库
+def dense_search(query: str, store, embedding_model, top_k: int) -> Tuple[List[str], List[str], List[float]]:
+    with tracing.span("embed"):
+        query_embedding = embedding_model.encode(query).tolist()
+    with tracing.span("vector_query", backend=store.backend, top_k=top_k) as span:
+        ids, documents, distances = store.query(query_embedding, top_k)
+        span.set(results=len(ids))
+    return ids, documents, distances
+
+
+# 提问后召回过程，粗略进行数据库向量匹配
+# embedding_model可以是编码模型本身，也可以是其前面的提问向量缓存
+def retrieve(query: str, store, embedding_model, top_k: int) -> List[str]:
+    return dense_search(query, store, embedding_model, top_k)[1]
+
+
+# 混合召回，返回融合后的片段以及与之按位置对应的向量距离，只由关键词召回命中的片段距离为inf
+def _hybrid_search(query: str, store, embedding_model, index: "lexical_index.LexicalIndex", top_k: int,
+                   dense_top_k: int, lexical_top_k: int) -> Tuple[List[str], List[float]]:
+    dense_ids, dense_documents, distances = dense_search(query, store, embedding_model, dense_top_k)
+    documents = dict(zip(dense_ids, dense_documents))
+    with tracing.span("bm25_search", top_k=lexical_top_k) as span:
+        lexical_ids = [doc_id for doc_id, _ in index.search(query, lexical_top_k)]
+        span.set(results=len(lexical_ids))
+
+    fused = lexical_index.reciprocal_rank_fusion([dense_ids, lexical_ids])[:top_k]
+    dense_distances = dict(zip(dense_ids, distances))
+    return ([documents[doc_id] if doc_id in documents else index.get_document(doc_id) for doc_id in fused],
+            [dense_distances.get(doc_id, math.inf) for doc_id in fused])
+
+
+# 混合召回：向量召回与BM25关键词召回分别取候选，用倒数排名融合合并，返回融合后前top_k个片段
+# 精确的作物名（如"草莓"、"上古水果"）由关键词召回保证命中，因此融合后只需少量候选送入重排
+def retrieve_hybrid(query: str, store, embedding_model, index: "lexical_index.LexicalIndex", top_k: int,
+                    dense_top_k: int = DENSE_TOP_K, lexical_top_k: int = LEXICAL_TOP_K) -> List[str]:
+    return _hybrid_search(query, store, embedding_model, index, top_k, dense_top_k, lexical_top_k)[0]
+
+
+def _score(query: str, chunks: List[str], cross_encoder, score_cache=None) -> List[float]:
+    if score_cache is not None:
+        return score_cache.score(query, chunks, cross_encoder)
+    pairs = [(query, chunk) for chunk in chunks]
+    return [float(score) for score in cross_encoder.predict(pairs)]
+
+
+# 提问后重排过程，对召回片段逐一进行比较打分；传入score_cache时跳过已打过分的组合
+def rerank(query: str, retrieved_chunks: List[str], cross_encoder, top_k: int, score_cache=None) -> List[str]:
+    if not retrieved_chunks:
+        return []
+    with tracing.span("rerank", candidates=len(retrieved_chunks), top_k=top_k):
+        scores = _score(query, retrieved_chunks, cross_encoder, score_cache)
+
+    chunk_with_scores = [(chunk, score) for chunk, score in zip(retrieved_chunks, scores)]
+    chunk_with_scores.sort(key=lambda pair: pair[1], reverse=True)
+
+    # 仅返回前几个分片
+    return [chunk for chunk, _ in chunk_with_scores[:top_k]]
+
+
+# 候选第1名与其余候选中向量距离最近者的相对距离差；distances与候选按位置对应，
+# 向量召回的候选已按距离排序，即第1、2名之差；混合召回时按融合后的顺序计算，缺少向量距离时返回None
+def distance_margin(distances: List[float]) -> Optional[float]:
+    if len(distances) < 2:
+        return None
+    runner_up = min(distances[1:])
+    if not math.isfinite(distances[0]) or not math.isfinite(runner_up) or runner_up <= 0:
+        return None
+    return (runner_up - distances[0]) / runner_up
+
+
+# 向量库距离度量对应的跳过阈值
+def skip_margin_for(store) -> Optional[float]:
+    return RERANK_SKIP_MARGIN.get(getattr(store, "distance_metric", None))
+
+
+# 自适应重排：召回足够可信时跳过cross-encoder，按候选的原顺序返回；否则按召回顺序小批打分，
+# 前top_k在新一批打分后不再变化或时间预算用完时提前结束，未打分的候选按召回顺序排在后面
+# distances与candidates按位置对应；skip_margin为None时不跳过，一般由skip_margin_for(store)给出
+# 实际走的路径（skip/stable/budget/full）写入stats，并计入aihelper_rerank_path_total指标
+def rerank_adaptive(query: str, candidates: List[str], distances: List[float], cross_encoder, top_k: int,
+                    score_cache=None, skip_margin: Optional[float] = None,
+                    batch_size: int = RERANK_BATCH_SIZE, budget_ms: float = RERANK_BUDGET_MS,
+                    stats: dict = None) -> List[str]:
+    stats = {} if stats is None else stats
+    with tracing.span("rerank", candidates=len(candidates), top_k=top_k, adaptive=True) as span:
+        chunks = _rerank_adaptive(query, candidates, distances, cross_encoder, top_k, score_cache, skip_margin,
+                                  batch_size, budget_ms, stats)
+        span.set(path=stats["rerank_path"], scored=stats["rerank_scored"], dense_margin=stats["dense_margin"])
+    tracing.count("aihelper_rerank_path_total", path=stats["rerank_path"])
+    return chunks
+
+
+def _rerank_adaptive(query: str, candidates: List[str], distances: List[float], cross_encoder, top_k: int,
+                     score_cache, skip_margin: Optional[float], batch_size: int, budget_ms: float,
+                     stats: dict) -> List[str]:
+    start = time.perf_counter()
+    margin = distance_margin(distances)
+    stats["dense_margin"] = margin
+
+    if not candidates:
+        path, scored = "full", []
+    elif margin is not None and skip_margin is not None and margin >= skip_margin:
+        path, scored = "skip", []
+    else:
+        path = "full"
+        scored: List[Tuple[int, float]] = []
+        previous_top = None
+        for begin in range(0, len(candidates), batch_size):
+            batch = candidates[begin:begin + batch_size]
+            scores = _score(query, batch, cross_encoder, score_cache)
+            scored.extend(zip(range(begin, begin + len(batch)), scores))
+
+            current_top = [i for i, _ in sorted(scored, key=lambda pair: pair[1], reverse=True)[:top_k]]
+            if begin + len(batch) >= len(candidates):
+                break
+            # 已打分数达到top_k后，新一批打分没有改变前top_k时提前结束
+            if previous_top is not None and current_top == previous_top:
+                path = "stable"
+                break
+            if (time.perf_counter() - start) * 1000 >= budget_ms:
+                path = "budget"
+                break
+            if len(scored) >= top_k:
+                previous_top = current_top
+
+    scored_indices = [i for i, _ in sorted(scored, key=lambda pair: pair[1], reverse=True)]
+    seen = set(scored_indices)
+    order = scored_indices + [i for i in range(len(candidates)) if i not in seen]
+
+    stats["rerank_path"] = path
+    stats["rerank_scored"] = len(scored)
+    stats["rerank_ms"] = (time.perf_counter() - start) * 1000
+    return [candidates[i] for i in order[:top_k]]
+
+
+# 批量重排：全部提问的(提问, 片段)组合去重后按批送入cross-encoder，返回每个提问得分最高的top_k个片段
+def rerank_many(queries: List[str], candidate_lists: List[List[str]], cross_encoder, top_k: int,
+                batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> List[List[str]]:
+    pairs = list(dict.fromkeys((query, chunk) for query, candidates in zip(queries, candidate_lists)
+                               for chunk in candidates))
+    scores = {}
+    with tracing.span("rerank_many", queries=len(queries), pairs=len(pairs), batch_size=batch_size):
+        for begin in range(0, len(pairs), batch_size):
+            batch = pairs[begin:begin + batch_size]
+            scores.update(zip(batch, (float(score) for score in cross_encoder.predict(batch))))
+    return [
+        sorted(candidates, key=lambda chunk: scores[(query, chunk)], reverse=True)[:top_k]
+        for query, candidates in zip(queries, candidate_lists)
+    ]
+
+
+# 重排前的候选片段及与之按位置对应的向量距离；传入index时使用混合召回，只保留融合后的前rerank_candidates个片段
+def retrieve_candidates(query: str, store, embedding_model, top_k1: int = 10,
+                        index: "lexical_index.LexicalIndex" = None,
+                        rerank_candidates: int = RERANK_CANDIDATES) -> Tuple[List[str], List[float]]:
+    if index is not None:
+        return _hybrid_search(query, store, embedding_model, index, rerank_candidates,
+                              dense_top_k=top_k1, lexical_top_k=top_k1)
+    _, retrieved, distances = dense_search(query, store, embedding_model, top_k1)
+    return retrieved, distances
+
+
+# 召回+重排；传入index时使用混合召回，只把融合后的前rerank_candidates个片段送入重排
+# adaptive为True时使用自适应重排，候选数默认为ADAPTIVE_RERANK_CANDIDATES，重排路径记录在stats中
+def retrieve_and_rerank(query: str, store, embedding_model, cross_encoder,
+                        top_k1: int = 10, top_k2: int = 4, score_cache=None,
+                        index: "lexical_index.LexicalIndex" = None,
+                        rerank_candidates: Optional[int] = None,
+                        adaptive: bool = False, stats: dict = None) -> List[str]:
+    if rerank_candidates is None:
+        rerank_candidates = ADAPTIVE_RERANK_CANDIDATES if adaptive else RERANK_CANDIDATES
+    retrieved, distances = retrieve_candidates(query, store, embedding_model, top_k1, index, rerank_candidates)
+
+    if adaptive:
+        return rerank_adaptive(query, retrieved, distances, cross_encoder, top_k2, score_cache,
+                               skip_margin_for(store), stats=stats)
+    return rerank(query, retrieved, cross_encoder, top_k2, score_cache)
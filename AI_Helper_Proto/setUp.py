@@ -1,44 +1,36 @@
-from typing import List
-from sentence_transformers import SentenceTransformer
-
-import chromadb
-
-
-# 分片方法
-def split_into_chunks(doc_file: str) -> List[str]:
-    with open(doc_file, 'r', encoding='utf-8') as file:
-        content = file.read()
-    return [chunk for chunk in content.split("\n\n")]
-
-
-chunks = split_into_chunks("./zuowu.txt")
-
-# 导入emdding模型
-embedding_model = SentenceTransformer("shibing624/text2vec-base-chinese")
-
-
-# 片段向量转化方法
-def embed_chunk(chunk: str) -> List[float]:
-    embedding = embedding_model.encode(chunk)
-    return embedding.tolist()
-
-
-embeddings = [embed_chunk(chunk) for chunk in chunks]
-
-# 建立向量知识库
-chromadb_client = chromadb.PersistentClient("zuowu.db")
-# 在chromadb中创建collection表
-chromadb_collection = chromadb_client.get_or_create_collection(name="default")
-
-
-# 1次性创建本地向量数据库
-def save_embeddings(chunks: List[str], embeddings: List[List[float]]) -> None:
-    ids = [str(i) for i in range(len(chunks))]
-    chromadb_collection.add(
-        documents=chunks,
-        embeddings=embeddings,
-        ids=ids
-    )
-
-
-save_embeddings(chunks, embeddings)
+import argparse
+
+import chunking
+import crop_query
+import knowledge_base
+
+
+# 知识库构建入口：python setUp.py [攻略文件 ...]；同时完成作物数据库的季节字段迁移
+def main() -> None:
+    parser = argparse.ArgumentParser(description="增量构建作物攻略向量知识库")
+    # 需要导入知识库的攻略文件，可指定多个
+    parser.add_argument("files", nargs="*", default=knowledge_base.DOC_FILES)
+    parser.add_argument("--batch-size", type=int, default=knowledge_base.EMBED_BATCH_SIZE, help="每批向量化的片段数")
+    parser.add_argument("--workers", type=int, default=1, help="向量化使用的进程数")
+    parser.add_argument("--max-tokens", type=int, default=chunking.CHUNK_MAX_TOKENS, help="每个片段的最大token数")
+    parser.add_argument("--overlap", type=int, default=chunking.CHUNK_OVERLAP_TOKENS, help="相邻片段重叠的token数")
+    parser.add_argument("--backend", choices=["chroma", "flat"], default=knowledge_base.VECTOR_BACKEND,
+                        help="写入的向量库后端")
+    args = parser.parse_args()
+
+    if crop_query.migrate_seasons():
+        print(f"{crop_query.DB_PATH}: 已补充season_mask季节字段")
+
+    legacy_count = knowledge_base.delete_legacy_chunks(args.backend)
+    if legacy_count:
+        print(f"已删除旧版片段{legacy_count}个")
+
+    for doc_file in args.files:
+        stats = knowledge_base.sync_document(doc_file, args.batch_size, args.workers, args.max_tokens, args.overlap,
+                                             args.backend)
+        print(f"{doc_file}: 共{stats['total']}个片段（最长{stats['max_tokens']}个token），新向量化{stats['embedded']}个，"
+              f"删除{stats['deleted']}个，更新元数据{stats['retagged']}个，速度{stats['chunks_per_sec']:.1f}片段/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+# 测试直接导入AI_Helper_Proto下的平铺模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crop_query  # noqa: E402
+
+CROPS_SCHEMA = """CREATE TABLE crops (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    season TEXT NOT NULL,
+    seed_sell TEXT NOT NULL,
+    seed_price INTEGER DEFAULT NULL,
+    sell_price INTEGER NOT NULL,
+    grow_type TEXT NOT NULL,
+    grow_time INTEGER NOT NULL,
+    maturity_time INTEGER DEFAULT NULL,
+    daily_revenue INTEGER NOT NULL,
+    remarks TEXT
+)"""
+CROP_SEASONS = ["春", "春夏", "夏", "夏秋", "秋", "冬", "春夏秋", "无"]
+
+
+# 与stardewValley.db结构相同的小型作物库（未迁移season_mask），取值范围很小以产生大量相同值，
+# 替换crop_query.DB_PATH并重置共享连接，测试结束后恢复
+@pytest.fixture
+def crops_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "crops.db")
+    generator = random.Random(0)
+    with sqlite3.connect(path) as conn:
+        conn.execute(CROPS_SCHEMA)
+        for index in range(60):
+            grow_type = generator.choice(["单次", "连续"])
+            conn.execute(
+                "INSERT INTO crops (name, season, seed_sell, seed_price, sell_price, grow_type, grow_time,"
+                " maturity_time, daily_revenue) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (f"作物{index}", generator.choice(CROP_SEASONS), "杂货店",
+                 generator.choice([None, 20, 50, 80]), generator.choice([35, 60, 120, 220]), grow_type,
+                 generator.randint(4, 9), generator.choice([2, 3, 4]) if grow_type == "连续" else None,
+                 generator.choice([5, 8, 10, 15])))
+    conn.close()
+
+    monkeypatch.setattr(crop_query, "DB_PATH", path)
+    monkeypatch.setattr(crop_query, "_connection", None)
+    monkeypatch.setattr(crop_query, "_season_expr", "season_mask")
+    yield path
+    if crop_query._connection is not None:
+        crop_query._connection.close()
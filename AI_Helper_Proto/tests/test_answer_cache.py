@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import answer_cache
+
+
+# 按字符计数的向量，季节和数字的权重很低：模拟embedding模型对只差季节或数字的提问给出很高的相似度
+class CharEmbedding:
+    def encode(self, text):
+        vector = np.zeros(4096, dtype=np.float32)
+        for char in text:
+            vector[ord(char) % 4096] += 0.2 if char in "春夏秋冬0123456789" else 1.0
+        return vector
+
+
+@pytest.fixture
+def cache(tmp_path):
+    source = tmp_path / "source.db"
+    source.write_bytes(b"crops")
+    cache = answer_cache.SemanticAnswerCache(CharEmbedding(), [str(source)], path=str(tmp_path / "answer_cache"),
+                                             save_delay=60)
+    yield cache
+    cache.flush()
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("春季最赚钱的作物是什么", "夏季最赚钱的作物是什么"),
+    ("秋季种什么最赚钱", "冬季种什么最赚钱"),
+    ("生长时间小于10天的作物", "生长时间小于12天的作物"),
+])
+def test_season_or_number_mismatch_misses(cache, stored, asked):
+    embedding_model = CharEmbedding()
+    a, b = (np.asarray(embedding_model.encode(text)) for text in (stored, asked))
+    assert a @ b / np.linalg.norm(a) / np.linalg.norm(b) >= cache.threshold
+    cache.store(stored, "回答")
+    assert cache.lookup(asked) is None
+
+
+def test_same_question_hits(cache):
+    cache.store("春季最赚钱的作物是什么", "草莓")
+    assert cache.lookup("春季最赚钱的作物是什么？") == "草莓"
+
+
+def test_refusals_not_cached(cache):
+    cache.store("星露谷的天气", "所获信息无法解决该问题。")
+    assert cache.lookup("星露谷的天气") is None
+
+
+def test_saved_on_flush(cache, tmp_path):
+    cache.store("春季最赚钱的作物是什么", "草莓")
+    assert not (tmp_path / "answer_cache.json").exists()
+    cache.flush()
+    reloaded = answer_cache.SemanticAnswerCache(CharEmbedding(), cache.source_paths, path=cache.path)
+    assert reloaded.lookup("春季最赚钱的作物是什么") == "草莓"
@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+import chat_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = chat_store.SqliteChatStore(str(tmp_path / "chat.db"), compact_interval=3600, legacy_path=None)
+    yield store
+    store.close()
+
+
+def test_auto_vacuum_enabled_before_wal(store):
+    conn = sqlite3.connect(store.path)
+    try:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        conn.close()
+
+
+def test_compact_shrinks_file(store):
+    for i in range(500):
+        store.append("session", {"role": "user", "content": f"{i}" * 2000})
+    store.flush()
+    store.compact()
+    size_before = os.path.getsize(store.path)
+
+    store.max_age_days = -1
+    assert store.compact() == 500
+    assert os.path.getsize(store.path) < size_before / 10
+
+
+def test_read_before_waits_for_own_session_only(store):
+    for i in range(5):
+        store.append("a", {"role": "user", "content": str(i)})
+    messages, cursor = store.read_before("a", None, 3)
+    assert [message["content"] for message in messages] == ["2", "3", "4"]
+    older, cursor = store.read_before("a", cursor, 3)
+    assert [message["content"] for message in older] == ["0", "1"]
+    assert cursor == 0
+
+
+def test_legacy_history_migrated_once(tmp_path):
+    legacy = tmp_path / "chat_history.json"
+    legacy.write_text(json.dumps([{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]),
+                      encoding="utf-8")
+    path = str(tmp_path / "chat.db")
+    for _ in range(2):
+        store = chat_store.SqliteChatStore(path, legacy_path=str(legacy))
+        messages, _ = store.session(chat_store.LEGACY_SESSION_ID).load_recent(10)
+        store.close()
+        assert [message["content"] for message in messages] == ["你好", "你好！"]
+
+
+def test_write_failure_does_not_block_reads_or_close(store, monkeypatch):
+    def fail(conn, rows):
+        if rows:
+            raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(store, "_insert", fail)
+    store.append("a", {"role": "user", "content": "丢失"})
+
+    start = time.monotonic()
+    assert store.read_before("a", None, 5) == ([], 0)
+    monkeypatch.undo()
+    store.append("a", {"role": "user", "content": "保存"})
+    assert [message["content"] for message in store.read_before("a", None, 5)[0]] == ["保存"]
+    store.close()
+    assert time.monotonic() - start < 2
+    assert not store._writer.is_alive()
+
+
+def test_jsonl_torn_tail_is_truncated(tmp_path):
+    path = str(tmp_path / "chat.jsonl")
+    store = chat_store.JsonlChatStore(path, legacy_path=None)
+    for index in range(6):
+        store.append({"role": "user", "content": f"第{index}条"})
+    with open(path, "ab") as file:
+        file.write(b'{"role": "assistant", "con')
+
+    store = chat_store.JsonlChatStore(path, legacy_path=None)
+    with open(path, "rb") as file:
+        assert file.read().endswith(b"\n")
+    messages, offset = store.load_recent(5)
+    assert [m["content"] for m in messages] == [f"第{index}条" for index in range(1, 6)]
+    assert offset == messages[0]["cursor"]
+
+    store.append({"role": "assistant", "content": "新消息"})
+    messages, _ = store.load_recent(2)
+    assert [m["content"] for m in messages] == ["第5条", "新消息"]
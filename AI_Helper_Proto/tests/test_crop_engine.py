@@ -0,0 +1,78 @@
+import itertools
+import os
+import sqlite3
+
+import pytest
+
+import crop_engine
+import crop_query
+
+from crop_query import CropQuery, NUMERIC_COLUMNS
+
+SEASONS = [None, "春", "夏秋", "春夏秋", "全季节", "无", "所有"]
+
+
+def ids(rows):
+    return [row["id"] for row in rows]
+
+
+# migrated为首次打开时完成迁移，readonly为迁移失败、退回LIKE匹配季节
+@pytest.fixture(params=["migrated", "readonly"])
+def engine(request, crops_db, monkeypatch):
+    if request.param == "readonly":
+        def fail(db_path):
+            raise sqlite3.OperationalError("attempt to write a readonly database")
+        monkeypatch.setattr(crop_query, "migrate_seasons", fail)
+    crop_query.get_connection()
+    assert (crop_query._season_expr == "season_mask") == (request.param == "migrated")
+    return crop_engine.CropEngine()
+
+
+@pytest.mark.parametrize("column", NUMERIC_COLUMNS)
+@pytest.mark.parametrize("sort_by", ["asc", "desc"])
+def test_order_matches_sql(engine, column, sort_by):
+    for top_n in (None, 1, 5):
+        query = CropQuery(sort_column=column, sort_by=sort_by, top_n=top_n)
+        assert ids(engine.run_query(query)) == ids(crop_query.run_query(query))
+
+
+@pytest.mark.parametrize("sort_by", ["asc", "desc"])
+def test_ties_ordered_by_id(engine, sort_by):
+    rows = engine.run_query(CropQuery(sort_column="sell_price", sort_by=sort_by))
+    keys = [(row["sell_price"], row["id"]) for row in rows]
+    assert len({price for price, _ in keys}) < len(keys)
+    reverse = sort_by == "desc"
+    assert keys == sorted(keys, key=lambda key: (-key[0] if reverse else key[0], key[1]))
+
+
+# 含NULL的列：升序时NULL在最前，降序时在最后，与SQLite一致
+def test_nulls_match_sql(engine):
+    for sort_by in ("asc", "desc"):
+        query = CropQuery(sort_column="seed_price", sort_by=sort_by)
+        rows = engine.run_query(query)
+        assert any(row["seed_price"] is None for row in rows)
+        assert ids(rows) == ids(crop_query.run_query(query))
+
+
+def test_season_filter_matches_sql(engine):
+    for season, season_match, sort_by in itertools.product(SEASONS, ["any", "all"], [None, "asc", "desc"]):
+        query = CropQuery(season=season, season_match=season_match, ranges={"grow_time": (5, None)},
+                          sort_column="daily_revenue", sort_by=sort_by)
+        assert ids(engine.run_query(query)) == ids(crop_query.run_query(query)), (season, season_match, sort_by)
+
+
+def test_reloads_when_database_changes(engine, crops_db):
+    query = CropQuery(season="冬", sort_column="sell_price", sort_by="desc", top_n=1)
+    engine.run_query(query)
+
+    with sqlite3.connect(crops_db) as conn:
+        conn.execute("INSERT INTO crops (name, season, seed_sell, seed_price, sell_price, grow_type, grow_time,"
+                     " daily_revenue) VALUES ('冬季新作物', '冬', '杂货店', 10, 9999, '单次', 4, 50)")
+    conn.close()
+    # 保证修改时间变化，不依赖文件系统的时间精度
+    stat = os.stat(crops_db)
+    os.utime(crops_db, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    rows = engine.run_query(query)
+    assert [row["name"] for row in rows] == ["冬季新作物"]
+    assert ids(rows) == ids(crop_query.run_query(query))
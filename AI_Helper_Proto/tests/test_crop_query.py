@@ -0,0 +1,53 @@
+import pytest
+
+import crop_query
+
+from crop_query import CropQuery
+
+
+def test_order_by_breaks_ties_by_id():
+    sql = crop_query.build_sql(CropQuery(sort_column="sell_price", sort_by="desc", top_n=3).shape())
+    assert sql.endswith("ORDER BY sell_price DESC, id LIMIT ?")
+    sql = crop_query.build_sql(CropQuery(season="春", ranges={"grow_time": (None, 8)}).shape())
+    assert sql.endswith("ORDER BY id")
+
+
+def test_sorted_rows_with_equal_values_follow_id(crops_db):
+    for sort_by in ("asc", "desc"):
+        rows = crop_query.run_query(CropQuery(sort_column="daily_revenue", sort_by=sort_by))
+        keys = [(row["daily_revenue"] * (-1 if sort_by == "desc" else 1), row["id"]) for row in rows]
+        assert keys == sorted(keys)
+
+
+def test_same_shape_shares_sql():
+    first = crop_query.build_sql(CropQuery(season="春", ranges={"sell_price": (100, None)}).shape())
+    second = crop_query.build_sql(CropQuery(season="冬", ranges={"sell_price": (50, None)}).shape())
+    assert first == second
+
+
+def test_union_all_batch_matches_single_queries(crops_db):
+    queries = [
+        CropQuery(season="春", sort_column="sell_price", sort_by="desc", top_n=3),
+        CropQuery(season="夏秋", season_match="any", ranges={"grow_time": (5, 7)}),
+        CropQuery(grow_type="连续", sort_column="maturity_time", sort_by="asc"),
+        CropQuery(season="冬", ranges={"sell_price": (10000, None)}),
+        CropQuery(season="春", sort_column="sell_price", sort_by="desc", top_n=3),
+    ]
+    results = crop_query.run_queries(queries)
+    assert results == [crop_query.run_query(query) for query in queries]
+    assert results[3] == []
+    assert all("query_index" not in row for rows in results for row in rows)
+    assert crop_query.run_queries([]) == []
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"ranges": {"price": (1, None)}},
+    {"ranges": {"sell_price; DROP TABLE crops": (1, None)}},
+    {"sort_column": "name", "sort_by": "asc"},
+    {"sort_column": "sell_price", "sort_by": "up"},
+    {"sort_column": "sell_price", "sort_by": "DESC, id"},
+    {"season": "春", "season_match": "some"},
+])
+def test_rejects_unknown_columns_and_directions(kwargs):
+    with pytest.raises(ValueError):
+        CropQuery(**kwargs)
@@ -0,0 +1,118 @@
+import gc
+import threading
+import time
+
+import pytest
+
+import fake_llm
+import llm_client
+
+MESSAGES = [{"role": "user", "parts": [{"text": "草莓生长几天"}]}]
+
+
+# 调用时阻塞到release被设置，使并发的相同请求确定地重叠
+class BlockingModel(fake_llm.FakeGenerativeModel):
+    def __init__(self, turns):
+        super().__init__(turns, chunk_size=2)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def generate_content(self, messages, stream=False, tool_config=None):
+        self.entered.set()
+        assert self.release.wait(5)
+        return super().generate_content(messages, stream=stream, tool_config=tool_config)
+
+
+# 按类名判断为可重试的临时性错误
+class ResourceExhausted(Exception):
+    pass
+
+
+class FlakyModel(fake_llm.FakeGenerativeModel):
+    def __init__(self, turns, failures, error=ResourceExhausted):
+        super().__init__(turns)
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+
+    def generate_content(self, messages, stream=False, tool_config=None):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error("429 quota exceeded")
+        return super().generate_content(messages, stream=stream, tool_config=tool_config)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_identical_concurrent_requests_share_one_call(stream):
+    model = BlockingModel([{"text": "草莓生长8天。"}, {"text": "第二次调用"}])
+    client = llm_client.LLMClient(lambda: model)
+    results, errors = [None] * 3, []
+
+    def request(index):
+        try:
+            response = client.generate_content(MESSAGES, stream=stream)
+            text = "".join(chunk.candidates[0].content.parts[0].text for chunk in response) if stream \
+                else response.text
+            results[index] = (response, text)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request, args=(index,)) for index in range(3)]
+    threads[0].start()
+    assert model.entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # 等后到的请求都进入等待后再放行
+    time.sleep(0.1)
+    model.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert not errors
+    assert len(model.calls) == 1
+    assert [text for _, text in results] == ["草莓生长8天。"] * 3
+    assert all(response is results[0][0] for response, _ in results)
+    assert not client._inflight
+
+
+def test_transient_error_is_retried():
+    model = FlakyModel([{"text": "草莓生长8天。"}], failures=2)
+    client = llm_client.LLMClient(lambda: model, max_retries=3, backoff_base=0.001, backoff_max=0.01)
+    assert client.generate_content(MESSAGES).text == "草莓生长8天。"
+    assert model.attempts == 3
+    assert len(model.calls) == 1
+
+
+def test_non_retryable_error_and_exhausted_retries_raise():
+    model = FlakyModel([{"text": "不会返回"}], failures=1, error=ValueError)
+    client = llm_client.LLMClient(lambda: model, backoff_base=0.001, backoff_max=0.01)
+    with pytest.raises(ValueError):
+        client.generate_content(MESSAGES)
+    assert model.attempts == 1
+
+    model = FlakyModel([{"text": "不会返回"}], failures=5)
+    client = llm_client.LLMClient(lambda: model, max_retries=2, backoff_base=0.001, backoff_max=0.01)
+    with pytest.raises(ResourceExhausted):
+        client.generate_content(MESSAGES)
+    assert model.attempts == 3
+    # 失败的请求归还名额，也不留在进行中的请求里
+    assert client._slots.acquire(blocking=False)
+    assert not client._inflight
+
+
+# 流式响应只读了一段就被丢弃时，回收后归还并发名额，后续请求不会阻塞
+def test_abandoned_stream_releases_slot():
+    model = fake_llm.FakeGenerativeModel([{"text": "草莓生长8天，可以多次收获。"}, {"text": "第二次调用"}],
+                                         chunk_size=2)
+    client = llm_client.LLMClient(lambda: model, max_concurrency=1)
+    response = client.generate_content(MESSAGES, stream=True)
+    chunks = iter(response)
+    next(chunks)
+    assert not client._slots.acquire(blocking=False)
+
+    del response, chunks
+    gc.collect()
+    assert client._slots.acquire(timeout=1)
+    client._slots.release()
+    assert not client._inflight
+    assert client.generate_content(MESSAGES, stream=True).text == "第二次调用"
@@ -0,0 +1,54 @@
+import fake_llm
+import pipeline
+
+
+class StaticContextBuilder:
+    def build(self, query, chunks, stats):
+        return "草莓：春季作物，生长8天。"
+
+
+def make_pipeline(model):
+    return pipeline.AnswerPipeline(None, None, None, context_builder=StaticContextBuilder(),
+                                   model_factory=lambda: model)
+
+
+def test_function_call_after_text_preamble_is_executed():
+    model = fake_llm.ScriptedGenerativeModel({
+        "草莓要长几天": [
+            {"text": "我先查一下。", "tool_calls": [{"name": "RAGCalling", "args": {"query": "草莓"}}]},
+            {"text": "草莓生长8天。"},
+        ],
+    })
+    stats = {}
+    answer = make_pipeline(model).generate_answer("草莓要长几天", stats, rag_chunks=["草莓"])
+    assert answer == "我先查一下。草莓生长8天。"
+    assert stats["tool_calls"] == 1 and stats["llm_calls"] == 2
+    assert stats["rag_prefetch"] == "used"
+
+
+# 第一段没有任何part，函数调用在第二段
+class EmptyFirstChunkModel(fake_llm.ScriptedGenerativeModel):
+    def generate_content(self, messages, stream=False, tool_config=None):
+        response = super().generate_content(messages, stream, tool_config)
+        response._chunks = [fake_llm.FakeContent([])] + response._chunks
+        return response
+
+
+def test_function_call_after_empty_chunk_is_executed():
+    model = EmptyFirstChunkModel({
+        "草莓要长几天": [
+            {"tool_calls": [{"name": "RAGCalling", "args": {"query": "草莓"}}]},
+            {"text": "草莓生长8天。"},
+        ],
+    })
+    stats = {}
+    answer = make_pipeline(model).generate_answer("草莓要长几天", stats, rag_chunks=["草莓"])
+    assert answer == "草莓生长8天。"
+    assert stats["tool_calls"] == 1
+
+
+def test_direct_answer_streams_without_tools():
+    model = fake_llm.ScriptedGenerativeModel({"你好": [{"text": "你好！我是星露谷小助手。"}]})
+    stats = {}
+    assert make_pipeline(model).generate_answer("你好", stats) == "你好！我是星露谷小助手。"
+    assert stats["tool_calls"] == 0 and stats["llm_calls"] == 1
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import vector_store
+
+
+def brute_force(matrix, query, top_k):
+    distances = ((np.asarray(matrix, dtype=np.float64) - query) ** 2).sum(axis=1)
+    top = np.argsort(distances, kind="stable")[:top_k]
+    return top, distances[top]
+
+
+def make_store(path, ids, vectors, dtype="float32"):
+    store = vector_store.FlatVectorStore(str(path), dtype=dtype)
+    store.upsert(ids, [f"片段{chunk_id}" for chunk_id in ids], vectors.tolist(),
+                 [{"source": f"doc{int(chunk_id[1:]) % 3}.md"} for chunk_id in ids])
+    return store
+
+
+# 小矩阵上与逐行计算的平方l2距离对比；块大小调小以覆盖分块计算
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+@pytest.mark.parametrize("flushed", [False, True])
+def test_query_matches_brute_force(tmp_path, monkeypatch, flushed, dtype):
+    monkeypatch.setattr(vector_store, "SEARCH_BLOCK_ROWS", 16)
+    generator = np.random.default_rng(0)
+    vectors = generator.normal(size=(50, 8)).astype(np.float32) * generator.uniform(0.5, 2.0, size=(50, 1))
+    ids = [f"c{row}" for row in range(50)]
+    store = make_store(tmp_path / "flat", ids, vectors, dtype)
+    if flushed:
+        store.flush()
+        store = vector_store.FlatVectorStore(str(tmp_path / "flat"), dtype=dtype)
+        # 写回后按保存精度的向量计算距离
+        vectors = vectors.astype(dtype)
+
+    for _ in range(10):
+        query = generator.normal(size=8).astype(np.float32)
+        result_ids, documents, distances = store.query(query, 5)
+        top, expected = brute_force(vectors, query, 5)
+        assert result_ids == [ids[row] for row in top]
+        assert documents == [f"片段{ids[row]}" for row in top]
+        np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-4)
+    assert len(store.query(vectors[0], 100)[0]) == 50
+    assert store.query(vectors[0], 0) == ([], [], [])
+
+
+def test_upsert_delete_round_trip(tmp_path):
+    generator = np.random.default_rng(1)
+    vectors = generator.normal(size=(20, 6)).astype(np.float32)
+    ids = [f"c{row}" for row in range(20)]
+    path = tmp_path / "flat"
+    make_store(path, ids, vectors).flush()
+
+    store = vector_store.FlatVectorStore(str(path), dtype="float32")
+    assert store.count() == 20
+    assert isinstance(store._matrix, np.memmap)
+
+    # 覆盖已有片段、新增片段、删除片段后再次写回
+    replaced = generator.normal(size=(2, 6)).astype(np.float32)
+    added = generator.normal(size=(1, 6)).astype(np.float32)
+    store.upsert(["c3", "c7"], ["新片段3", "新片段7"], replaced.tolist(), [{"source": "new.md"}] * 2)
+    store.upsert(["c20"], ["片段c20"], added.tolist(), [{"source": "doc2.md"}])
+    store.delete(["c0", "c11", "missing"])
+    store.flush()
+
+    expected = dict(zip(ids, vectors))
+    expected.update({"c3": replaced[0], "c7": replaced[1], "c20": added[0]})
+    for chunk_id in ("c0", "c11"):
+        del expected[chunk_id]
+
+    reopened = vector_store.FlatVectorStore(str(path), dtype="float32")
+    assert reopened.count() == 19
+    assert isinstance(reopened._matrix, np.memmap)
+    data = reopened.get(embeddings=True)
+    assert sorted(data["ids"]) == sorted(expected)
+    for chunk_id, embedding in zip(data["ids"], data["embeddings"]):
+        np.testing.assert_array_equal(embedding, expected[chunk_id])
+    assert reopened.get(source="new.md")["documents"] == ["新片段3", "新片段7"]
+
+    matrix = np.stack([expected[chunk_id] for chunk_id in data["ids"]])
+    query = generator.normal(size=6).astype(np.float32)
+    top, distances = brute_force(matrix, query, 4)
+    result_ids, _, result_distances = reopened.query(query, 4)
+    assert result_ids == [data["ids"][row] for row in top]
+    np.testing.assert_allclose(result_distances, distances, rtol=1e-4, atol=1e-4)
@@ -1,260 +1,101 @@
-import sqlite3
+import inspect
 
+import crop_engine
+import crop_query
+import tracing
 
-TOOLS_LIST = {
-    "function_declarations": [
-        {
-            "name": "get_crops_by_sellprice",
-            "description": "根据季节、作物售价范围、成熟类型和排序方式检索农作物信息。该工具能够处理灵活的查询，并能按需返回特定数量的结果。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "season": {
-                        "type": "string",
-                        "description": "农作物的季节，如'春'、'夏'、'秋'或多个季节的组合（例如'春夏'）。如果未提供，则默认为所有季节。"
-                    },
-                    "min_price": {
-                        "type": "integer",
-                        "description": "农作物销售价格的最低值。如果只提供了最低价，则返回所有售价高于该价格的农作物。"
-                    },
-                    "max_price": {
-                        "type": "integer",
-                        "description": "农作物销售价格的最高值。如果只提供了最高价，则返回所有售价低于该价格的农作物。"
-                    },
-                    "grow_type": {
-                        "type": "string",
-                        "enum": ["单次", "连续"],
-                        "description": "农作物的成熟类型。如果未提供，则返回所有类型。"
-                    },
-                    "sort_by": {
-                        "type": "string",
-                        "enum": ["asc", "desc"],
-                        "description": "结果根据作物售价的排序方向。'asc'为升序（从低到高），'desc'为降序（从高到低）。如果未提供，则按数据默认顺序返回。"
-                    },
-                    "top_n": {
-                        "type": "integer",
-                        "description": "要返回的前几项数据。如果未提供，则返回所有符合条件的记录。"
-                    }
-                },
-                "required": []
-            }
-        },
-        {
-            "name": "get_crops_by_dailyrevenue",
-            "description": "根据季节、每日利润范围、成熟类型和排序方式检索农作物信息。该工具能够处理灵活的查询，并能按需返回特定数量的结果。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "season": {
-                        "type": "string",
-                        "description": "农作物的季节，如'春'、'夏'、'秋'或多个季节的组合（例如'春夏'）。如果未提供，则默认为所有季节。"
-                    },
-                    "min_revenue": {
-                        "type": "integer",
-                        "description": "农作物每日利润的最低值。如果只提供了最低值，则返回所有每日利润高于该值的农作物。"
-                    },
-                    "max_revenue": {
-                        "type": "integer",
-                        "description": "农作物每日利润的最高值。如果只提供了最高值，则返回所有每日利润低于该值的农作物。"
-                    },
-                    "grow_type": {
-                        "type": "string",
-                        "enum": ["单次", "连续"],
-                        "description": "农作物的成熟类型。如果未提供，则返回所有类型。"
-                    },
-                    "sort_by": {
-                        "type": "string",
-                        "enum": ["asc", "desc"],
-                        "description": "结果根据每日利润的排序方向。'asc'为升序（从低到高），'desc'为降序（从高到低）。如果未提供，则按数据默认顺序返回。"
-                    },
-                    "top_n": {
-                        "type": "integer",
-                        "description": "要返回的前几项数据。如果未提供，则返回所有符合条件的记录。"
-                    }
-                },
-                "required": []
-            }
-        },
-        {
-            "name": "get_crops_by_seedprice",
-            "description": "根据季节、种子价格范围、成熟类型和排序方式检索农作物信息。该工具能够处理灵活的查询，并能按需返回特定数量的结果。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "season": {
-                        "type": "string",
-                        "description": "农作物的季节，如'春'、'夏'、'秋'或多个季节的组合（例如'春夏'）。如果未提供，则默认为所有季节。"
-                    },
-                    "min_revenue": {
-                        "type": "integer",
-                        "description": "农作物种子售价的最低值。如果只提供了最低值，则返回所有种子售价高于该值的农作物。"
-                    },
-                    "max_revenue": {
-                        "type": "integer",
-                        "description": "农作物种子售价的最高值。如果只提供了最高值，则返回所有种子售价低于该值的农作物。"
-                    },
-                    "grow_type": {
-                        "type": "string",
-                        "enum": ["单次", "连续"],
-                        "description": "农作物的成熟类型。如果未提供，则返回所有类型。"
-                    },
-                    "sort_by": {
-                        "type": "string",
-                        "enum": ["asc", "desc"],
-                        "description": "结果根据种子售价的排序方向。'asc'为升序（从低到高），'desc'为降序（从高到低）。如果未提供，则按数据默认顺序返回。"
-                    },
-                    "top_n": {
-                        "type": "integer",
-                        "description": "要返回的前几项数据。如果未提供，则返回所有符合条件的记录。"
-                    }
-                },
-                "required": []
-            }
-        },
-        {
-            "name": "get_crops_by_growtime",
-            "description": "根据季节、作物生长所需时间范围、成熟类型排序方式检索农作物信息。该工具能够处理灵活的查询，并能按需返回特定数量的结果。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "season": {
-                        "type": "string",
-                        "description": "农作物的季节，如'春'、'夏'、'秋'或多个季节的组合（例如'春夏'）。如果未提供，则默认为所有季节。"
-                    },
-                    "min_revenue": {
-                        "type": "integer",
-                        "description": "农作物生长所需时间的最低值。如果只提供了最低值，则返回所有生长所需时间高于该值的农作物。"
-                    },
-                    "max_revenue": {
-                        "type": "integer",
-                        "description": "农作物生长所需时间的最高值。如果只提供了最高值，则返回所有生长所需时间低于该值的农作物。"
-                    },
-                    "grow_type": {
-                        "type": "string",
-                        "enum": ["单次", "连续"],
-                        "description": "农作物的成熟类型。如果未提供，则返回所有类型。"
-                    },
-                    "sort_by": {
-                        "type": "string",
-                        "enum": ["asc", "desc"],
-                        "description": "结果根据作物生长所需时间的排序方向。'asc'为升序（从低到高），'desc'为降序（从高到低）。如果未提供，则按数据默认顺序返回。"
-                    },
-                    "top_n": {
-                        "type": "integer",
-                        "description": "要返回的前几项数据。如果未提供，则返回所有符合条件的记录。"
-                    }
-                },
-                "required": []
-            }
+from typing import Callable, Dict, List, Sequence, Tuple
+from crop_query import CropQuery, NUMERIC_COLUMNS
+
+# 作物查询执行后端："memory"为内存列式引擎，"sql"为预编译语句+长期只读连接
+CROP_BACKEND = "memory"
+
+# 数值列在工具描述中的名称
+COLUMN_LABELS = {
+    "seed_price": "种子售价",
+    "sell_price": "作物售价",
+    "grow_time": "生长所需时间",
+    "maturity_time": "收获间隔",
+    "daily_revenue": "每日利润",
+}
+
+# 按单个数值列筛选和排序的作物工具：(工具名, 数值列, 最低值参数名, 最高值参数名)
+CROP_TOOL_SPECS = [
+    ("get_crops_by_sellprice", "sell_price", "min_price", "max_price"),
+    ("get_crops_by_dailyrevenue", "daily_revenue", "min_revenue", "max_revenue"),
+    ("get_crops_by_seedprice", "seed_price", "min_price", "max_price"),
+    ("get_crops_by_growtime", "grow_time", "min_growtime", "max_growtime"),
+]
+
+# 各作物工具共用的参数
+COMMON_PROPERTIES = {
+    "season": {
+        "type": "string",
+        "description": "农作物的季节，如'春'、'夏'、'秋'或多个季节的组合（例如'春夏'）。如果未提供，则默认为所有季节。"
+    },
+    "season_match": {
+        "type": "string",
+        "enum": ["any", "all"],
+        "description": "多个季节时的匹配方式。'any'为在任一所给季节可种植即可，'all'为需要在所给的全部季节都可种植（跨季作物）。如果未提供，则为'all'。"
+    },
+    "grow_type": {
+        "type": "string",
+        "enum": ["单次", "连续"],
+        "description": "农作物的成熟类型。如果未提供，则返回所有类型。"
+    },
+    "top_n": {
+        "type": "integer",
+        "description": "要返回的前几项数据。如果未提供，则返回所有符合条件的记录。"
+    },
+}
+
+
+def _range_properties(label: str, min_param: str, max_param: str) -> Dict[str, dict]:
+    return {
+        min_param: {
+            "type": "integer",
+            "description": f"农作物{label}的最低值。如果只提供了最低值，则返回所有{label}高于该值的农作物。"
         },
-        {
-            "name": "RAGCalling",
-            "description": "若其他工具无法解决问题，则调用此函数来对RAG知识库检索获取信息。"
+        max_param: {
+            "type": "integer",
+            "description": f"农作物{label}的最高值。如果只提供了最高值，则返回所有{label}低于该值的农作物。"
         },
-    ]
-}
+    }
 
-# 根据售价范围获取对应季节的农作物
-def get_crops_by_sellprice(season: str = None, min_price: int = None, max_price: int = None, grow_type: str = None, sort_by: str = None, top_n: int = None) -> str:
-    print("calling get_crops_by_sellprice")
-    with sqlite3.connect('stardewValley.db') as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 构建动态SQL查询
-        query = "SELECT * FROM crops WHERE 1=1"
-        params = []
-
-        if season is not None:
-            query += " AND season LIKE ?"
-            params.append(f"%{season}%")
-
-        if min_price is not None and max_price is not None:
-            query += " AND sell_price BETWEEN ? AND ?"
-            params.append(min_price)
-            params.append(max_price)
-        elif min_price is not None:
-            query += " AND sell_price >= ?"
-            params.append(min_price)
-        elif max_price is not None:
-            query += " AND sell_price <= ?"
-            params.append(max_price)
-
-        if grow_type is not None:
-            query += " AND grow_type = ?"
-            params.append(grow_type)
-
-        if sort_by:
-            order = "ASC" if sort_by == "asc" else "DESC"
-            query += f" ORDER BY sell_price {order}"
-
-        if top_n is not None and top_n > 0:
-            query += " LIMIT ?"
-            params.append(top_n)
-
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
 
-    if not results:
-        return "未找到符合条件的作物。"
+def _sort_property(label: str) -> dict:
+    return {
+        "type": "string",
+        "enum": ["asc", "desc"],
+        "description": f"结果根据{label}的排序方向。'asc'为升序（从低到高），'desc'为降序（从高到低）。如果未提供，则按数据默认顺序返回。"
+    }
 
-    output = "找到以下农作物:\n"
-    for row in results:
-        output += f"{row['name']}-季节:{row['season']}-种子来源:{row['seed_sell']}"
-        if row['seed_sell'] != "非固定":
-            output += f"-种子售价:{row['seed_price']}G"
-        output += f"-作物基础售价:{row['sell_price']}G-收获种类:{row['grow_type']}收获-生长时间:{row['grow_time']}天"
-        if row['grow_type'] == "连续":
-            output += f"-收获间隔:{row['maturity_time']}天"
-        output += f"-基础日均收益:{row['daily_revenue']}G\n"
 
-    return output
+# 执行一批作物查询，按CROP_BACKEND选择内存引擎或SQL
+def run_crop_queries(queries: Sequence[CropQuery]) -> List[List[dict]]:
+    with tracing.span("crop_query", backend=CROP_BACKEND, queries=len(queries)) as span:
+        if CROP_BACKEND == "sql":
+            results = crop_query.run_queries(queries)
+        else:
+            results = crop_engine.get_engine().run_queries(queries)
+        span.set(rows=sum(len(rows) for rows in results))
+        return results
 
 
-# 根据每日收益范围获取对应季节的农作物
-def get_crops_by_dailyrevenue(season: str = None, min_revenue: int = None, max_revenue: int = None, grow_type: str = None, sort_by: str = None, top_n: int = None) -> str:
-    print("calling get_crops_by_dailyrevenue")
-    with sqlite3.connect('stardewValley.db') as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 构建动态SQL查询
-        query = "SELECT * FROM crops WHERE 1=1"
-        params = []
-
-        if season is not None:
-            query += " AND season LIKE ?"
-            params.append(f"%{season}%")
-
-        if min_revenue is not None and max_revenue is not None:
-            query += " AND daily_revenue BETWEEN ? AND ?"
-            params.append(min_revenue)
-            params.append(max_revenue)
-        elif min_revenue is not None:
-            query += " AND daily_revenue >= ?"
-            params.append(min_revenue)
-        elif max_revenue is not None:
-            query += " AND daily_revenue <= ?"
-            params.append(max_revenue)
-
-        if grow_type is not None:
-            query += " AND grow_type = ?"
-            params.append(grow_type)
-
-        if sort_by:
-            order = "ASC" if sort_by == "asc" else "DESC"
-            query += f" ORDER BY daily_revenue {order}"
-
-        if top_n is not None and top_n > 0:
-            query += " LIMIT ?"
-            params.append(top_n)
-
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
+def run_crop_query(query: CropQuery) -> List[dict]:
+    return run_crop_queries([query])[0]
 
+
+# 将查询结果格式化为回答文本
+def format_crops(results) -> str:
     if not results:
         return "未找到符合条件的作物。"
 
+    with tracing.span("format_crops", rows=len(results)):
+        return _format_rows(results)
+
+
+def _format_rows(results) -> str:
     output = "找到以下农作物:\n"
     for row in results:
         output += f"{row['name']}-季节:{row['season']}-种子来源:{row['seed_sell']}"
@@ -267,115 +108,106 @@ def get_crops_by_dailyrevenue(season: str = None, min_revenue: int = None, max_r
 
     return output
 
-# 根据种子价格范围获取对应季节的农作物
-def get_crops_by_seedprice(season: str = None, min_price: int = None, max_price: int = None, grow_type: str = None, sort_by: str = None, top_n: int = None) -> str:
-    print("calling get_crops_by_seedprice")
-    with sqlite3.connect('stardewValley.db') as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 构建动态SQL查询
-        query = "SELECT * FROM crops WHERE 1=1"
-        params = []
-
-        if season is not None:
-            query += " AND season LIKE ?"
-            params.append(f"%{season}%")
-
-        if min_price is not None and max_price is not None:
-            query += " AND seed_price BETWEEN ? AND ?"
-            params.append(min_price)
-            params.append(max_price)
-        elif min_price is not None:
-            query += " AND seed_price >= ?"
-            params.append(min_price)
-        elif max_price is not None:
-            query += " AND seed_price <= ?"
-            params.append(max_price)
-
-        if grow_type is not None:
-            query += " AND grow_type = ?"
-            params.append(grow_type)
-
-        if sort_by:
-            order = "ASC" if sort_by == "asc" else "DESC"
-            query += f" ORDER BY seed_price {order}"
-
-        if top_n is not None and top_n > 0:
-            query += " LIMIT ?"
-            params.append(top_n)
-
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
 
-    if not results:
-        return "未找到符合条件的作物。"
+# 根据单列工具规格生成函数声明和对应的查询函数
+def make_crop_tool(name: str, column: str, min_param: str, max_param: str) -> Tuple[dict, Callable[..., str]]:
+    label = COLUMN_LABELS[column]
+    declaration = {
+        "name": name,
+        "description": f"根据季节、{label}范围、成熟类型和排序方式检索农作物信息。该工具能够处理灵活的查询，并能按需返回特定数量的结果。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "season": COMMON_PROPERTIES["season"],
+                "season_match": COMMON_PROPERTIES["season_match"],
+                **_range_properties(label, min_param, max_param),
+                "grow_type": COMMON_PROPERTIES["grow_type"],
+                "sort_by": _sort_property(label),
+                "top_n": COMMON_PROPERTIES["top_n"],
+            },
+            "required": []
+        }
+    }
+
+    # 参数名与函数声明保持一致，同时支持按位置传参
+    signature = inspect.Signature([
+        inspect.Parameter(param, inspect.Parameter.POSITIONAL_OR_KEYWORD, default=None)
+        for param in ["season", min_param, max_param, "grow_type", "sort_by", "top_n", "season_match"]
+    ])
+
+    def crop_tool(*args, **kwargs) -> str:
+        params = signature.bind(*args, **kwargs).arguments
+        query = CropQuery(season=params.get("season"), season_match=params.get("season_match") or "all",
+                          ranges={column: (params.get(min_param), params.get(max_param))},
+                          grow_type=params.get("grow_type"), sort_column=column,
+                          sort_by=params.get("sort_by"), top_n=params.get("top_n"))
+        return format_crops(run_crop_query(query))
+
+    crop_tool.__name__ = name
+    crop_tool.__signature__ = signature
+    return declaration, crop_tool
+
+
+# 通用作物查询工具：可同时对多个数值列做范围筛选，并按任意数值列排序
+QUERY_CROPS_DECLARATION = {
+    "name": "query_crops",
+    "description": "根据季节、成熟类型以及任意多个数值条件（种子售价、作物售价、生长所需时间、收获间隔、每日利润）组合检索农作物信息，并可按任一数值列排序、返回前几项。",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "season": COMMON_PROPERTIES["season"],
+            "season_match": COMMON_PROPERTIES["season_match"],
+            **{name: prop for column in NUMERIC_COLUMNS
+               for name, prop in _range_properties(COLUMN_LABELS[column], f"min_{column}", f"max_{column}").items()},
+            "grow_type": COMMON_PROPERTIES["grow_type"],
+            "sort_column": {
+                "type": "string",
+                "enum": NUMERIC_COLUMNS,
+                "description": "排序所依据的数值列。如果未提供，则按数据默认顺序返回。"
+            },
+            "sort_by": _sort_property("排序列"),
+            "top_n": COMMON_PROPERTIES["top_n"],
+        },
+        "required": []
+    }
+}
 
-    output = "找到以下农作物:\n"
-    for row in results:
-        output += f"{row['name']}-季节:{row['season']}-种子来源:{row['seed_sell']}"
-        if row['seed_sell'] != "非固定":
-            output += f"-种子售价:{row['seed_price']}G"
-        output += f"-作物基础售价:{row['sell_price']}G-收获种类:{row['grow_type']}收获-生长时间:{row['grow_time']}天"
-        if row['grow_type'] == "连续":
-            output += f"-收获间隔:{row['maturity_time']}天"
-        output += f"-基础日均收益:{row['daily_revenue']}G\n"
 
-    return output
+def query_crops(season: str = None, grow_type: str = None, sort_column: str = None, sort_by: str = None,
+                top_n: int = None, season_match: str = "all", **bounds) -> str:
+    ranges = {}
+    for column in NUMERIC_COLUMNS:
+        low, high = bounds.pop(f"min_{column}", None), bounds.pop(f"max_{column}", None)
+        ranges[column] = (low, high)
+    if bounds:
+        raise TypeError(f"query_crops() got unexpected arguments: {', '.join(sorted(bounds))}")
+    query = CropQuery(season=season, season_match=season_match or "all", ranges=ranges, grow_type=grow_type,
+                      sort_column=sort_column, sort_by=sort_by, top_n=top_n)
+    return format_crops(run_crop_query(query))
 
 
-# 根据作物生长时间范围获取对应季节的农作物
-def get_crops_by_growtime(season: str = None, min_growtime: int = None, max_growtime: int = None, grow_type: str = None, sort_by: str = None, top_n: int = None) -> str:
-    print("calling get_crops_by_seedprice")
-    with sqlite3.connect('stardewValley.db') as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # 构建动态SQL查询
-        query = "SELECT * FROM crops WHERE 1=1"
-        params = []
-
-        if season is not None:
-            query += " AND season LIKE ?"
-            params.append(f"%{season}%")
-
-        if min_growtime is not None and max_growtime is not None:
-            query += " AND grow_time BETWEEN ? AND ?"
-            params.append(min_growtime)
-            params.append(max_growtime)
-        elif min_growtime is not None:
-            query += " AND grow_time >= ?"
-            params.append(min_growtime)
-        elif max_growtime is not None:
-            query += " AND grow_time <= ?"
-            params.append(max_growtime)
-
-        if grow_type is not None:
-            query += " AND grow_type = ?"
-            params.append(grow_type)
-
-        if sort_by:
-            order = "ASC" if sort_by == "asc" else "DESC"
-            query += f" ORDER BY grow_time {order}"
-
-        if top_n is not None and top_n > 0:
-            query += " LIMIT ?"
-            params.append(top_n)
-
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
+_crop_tools = [make_crop_tool(*spec) for spec in CROP_TOOL_SPECS]
 
-    if not results:
-        return "未找到符合条件的作物。"
+# 函数名到实际函数的映射
+TOOL_FUNCTIONS: Dict[str, Callable[..., str]] = {function.__name__: function for _, function in _crop_tools}
+TOOL_FUNCTIONS["query_crops"] = query_crops
 
-    output = "找到以下农作物:\n"
-    for row in results:
-        output += f"{row['name']}-季节:{row['season']}-种子来源:{row['seed_sell']}"
-        if row['seed_sell'] != "非固定":
-            output += f"-种子售价:{row['seed_price']}G"
-        output += f"-作物基础售价:{row['sell_price']}G-收获种类:{row['grow_type']}收获-生长时间:{row['grow_time']}天"
-        if row['grow_type'] == "连续":
-            output += f"-收获间隔:{row['maturity_time']}天"
-        output += f"-基础日均收益:{row['daily_revenue']}G\n"
+# 根据售价范围获取对应季节的农作物
+get_crops_by_sellprice = TOOL_FUNCTIONS["get_crops_by_sellprice"]
+# 根据每日收益范围获取对应季节的农作物
+get_crops_by_dailyrevenue = TOOL_FUNCTIONS["get_crops_by_dailyrevenue"]
+# 根据种子价格范围获取对应季节的农作物
+get_crops_by_seedprice = TOOL_FUNCTIONS["get_crops_by_seedprice"]
+# 根据作物生长时间范围获取对应季节的农作物
+get_crops_by_growtime = TOOL_FUNCTIONS["get_crops_by_growtime"]
 
-    return output
\ No newline at end of file
+TOOLS_LIST = {
+    "function_declarations": [
+        *[declaration for declaration, _ in _crop_tools],
+        QUERY_CROPS_DECLARATION,
+        {
+            "name": "RAGCalling",
+            "description": "若其他工具无法解决问题，则调用此函数来对RAG知识库检索获取信息。"
+        },
+    ]
+}
@@ -0,0 +1,239 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_DIR = os.path.join(BASE_DIR, "traces")
+# 滚动的JSONL追踪文件，每行一个span
+TRACE_PATH = os.path.join(TRACE_DIR, "trace.jsonl")
+TRACE_MAX_BYTES = 5 * 2 ** 20
+TRACE_BACKUP_COUNT = 3
+# Prometheus文本格式的指标文件，每个请求结束后刷新
+METRICS_PATH = os.path.join(TRACE_DIR, "metrics.prom")
+# 是否写入追踪文件和指标文件，关闭后仍在内存中统计
+TRACE_TO_FILE = True
+# 内存中保留的最近请求数，供侧边栏展示
+RECENT_TRACES = 64
+# span耗时直方图的分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# 一段计时的操作，属性记录top_k、片段数、工具名、token数、缓存命中等
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.duration_ms: Optional[float] = None
+        self._start_perf = time.perf_counter()
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+# 进程内的计数器和直方图，按Prometheus文本格式输出
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, tuple], float] = defaultdict(float)
+        # (指标名, 标签) -> [各分桶计数..., 总和, 总数]
+        self._histograms: Dict[Tuple[str, tuple], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.buckets, histogram):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count:g}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram[-1]:g}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+_recent: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_recent_lock = threading.Lock()
+_trace_logger: Optional[logging.Logger] = None
+_logger_lock = threading.Lock()
+_metrics_file_lock = threading.Lock()
+
+
+def _get_trace_logger() -> logging.Logger:
+    global _trace_logger
+    with _logger_lock:
+        if _trace_logger is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            logger = logging.getLogger("aihelper.trace")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(TRACE_PATH, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT,
+                                          encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _trace_logger = logger
+        return _trace_logger
+
+
+# 计时一段操作；在已有span内调用时成为其子span，属于同一个请求
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    parent = _current.get()
+    current = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None,
+                   attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.finish()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 生成器中的span可能在另一个上下文中结束
+            _current.set(parent)
+        _record(current, is_root=parent is None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+# 给当前span添加属性，不在任何span中时忽略
+def set_attributes(**attributes) -> None:
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def count(name: str, value: float = 1.0, **labels) -> None:
+    metrics.inc(name, value, **labels)
+
+
+# 让函数在线程池中执行时沿用提交时的span作为父span
+def bind(function: Callable) -> Callable:
+    parent = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def _record(finished: Span, is_root: bool) -> None:
+    record = finished.to_dict()
+    metrics.observe("aihelper_span_duration_seconds", finished.duration_ms / 1000, span=finished.name)
+    if "error" in finished.attributes:
+        metrics.inc("aihelper_span_errors_total", span=finished.name)
+
+    with _recent_lock:
+        _recent.setdefault(finished.trace_id, []).append(record)
+        _recent.move_to_end(finished.trace_id)
+        while len(_recent) > RECENT_TRACES:
+            _recent.popitem(last=False)
+
+    if TRACE_TO_FILE:
+        _get_trace_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+        if is_root:
+            write_metrics()
+
+
+# 某个请求的全部span，按开始时间排序
+def get_trace(trace_id: str) -> List[Dict[str, Any]]:
+    with _recent_lock:
+        return sorted(_recent.get(trace_id, []), key=lambda record: record["start"])
+
+
+# 写入指标文件，先写临时文件再替换，供node_exporter的textfile采集
+def write_metrics(path: Optional[str] = None) -> None:
+    path = path or METRICS_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _metrics_file_lock:
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(metrics.render())
+        os.replace(path + ".tmp", path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 在后台线程中提供/metrics接口，供Prometheus直接抓取
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
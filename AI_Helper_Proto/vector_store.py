@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 平铺索引的文件：片段向量矩阵、各行向量的平方范数，以及按行对应的片段id、内容和元数据
+FLAT_EMBEDDINGS_FILE = "embeddings.npy"
+FLAT_NORMS_FILE = "norms.npy"
+FLAT_CHUNKS_FILE = "chunks.jsonl"
+# 平铺索引每次参与矩阵乘法的行数，float16矩阵按块转换为float32，避免整体复制
+SEARCH_BLOCK_ROWS = 65536
+# 平铺索引单次写入的片段数上限，与chromadb的批量写入保持同一接口
+FLAT_MAX_BATCH_SIZE = 4096
+
+
+# 向量库接口：ChromaVectorStore和FlatVectorStore提供相同的方法
+#   query(向量, top_k) -> (片段id, 片段, 距离)，距离越小越相似；distance_metric为距离的度量
+#   get(source, embeddings) -> {"ids", "documents", "metadatas"[, "embeddings"]}
+#   upsert / update_metadata / delete写入，flush后对其他进程可见
+#   data_files()为决定向量库内容的文件，用于缓存失效判断
+
+
+# 现有的chromadb集合（HNSW索引，l2距离）
+class ChromaVectorStore:
+    backend = "chroma"
+
+    def __init__(self, collection, client, path: str):
+        self.collection = collection
+        self.client = client
+        self.path = path
+        self.distance_metric = (collection.metadata or {}).get("hnsw:space", "l2")
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def query(self, embedding: Sequence[float], top_k: int) -> Tuple[List[str], List[str], List[float]]:
+        results = self.collection.query(query_embeddings=[list(embedding)], n_results=top_k)
+        return results['ids'][0], results['documents'][0], results['distances'][0]
+
+    def get(self, source: Optional[str] = None, embeddings: bool = False) -> Dict[str, list]:
+        include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+        data = self.collection.get(where={"source": source} if source else None, include=include)
+        result = {"ids": data['ids'], "documents": data['documents'], "metadatas": data['metadatas']}
+        if embeddings:
+            result["embeddings"] = data['embeddings']
+        return result
+
+    def upsert(self, ids: List[str], documents: List[str], embeddings: List[List[float]],
+               metadatas: List[Dict]) -> None:
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]) -> None:
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids: List[str]) -> None:
+        if ids:
+            self.collection.delete(ids=ids)
+
+    # chromadb每次写入时已持久化
+    def flush(self) -> None:
+        pass
+
+    def max_batch_size(self) -> int:
+        return self.client.get_max_batch_size()
+
+    def data_files(self) -> List[str]:
+        return [os.path.join(self.path, "chroma.sqlite3")]
+
+
+# 精确的平铺向量索引：向量原样保存为.npy矩阵，以内存映射方式只读打开，
+# 加载几乎不耗时，多个进程共享同一份页缓存；检索为矩阵-向量乘法后取前top_k，召回是精确的。
+# 距离与chromadb默认的l2相同，为未归一化向量间的平方l2距离，各行的平方范数在flush时预先算好。
+# 片段id、内容和元数据按行保存在JSONL旁路文件中；写入先在内存中完成，flush时整体替换文件。
+# 其他进程重写索引后，按旁路文件的修改时间和大小自动重新加载
+class FlatVectorStore:
+    backend = "flat"
+    distance_metric = "l2"
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._dirty = False
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._norms: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+
+    @property
+    def _embeddings_path(self) -> str:
+        return os.path.join(self.path, FLAT_EMBEDDINGS_FILE)
+
+    @property
+    def _norms_path(self) -> str:
+        return os.path.join(self.path, FLAT_NORMS_FILE)
+
+    @property
+    def _chunks_path(self) -> str:
+        return os.path.join(self.path, FLAT_CHUNKS_FILE)
+
+    def _file_signature(self):
+        if not os.path.exists(self._chunks_path):
+            return None
+        stat = os.stat(self._chunks_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    # 有未flush的写入时以内存中的数据为准
+    def _ensure_loaded(self) -> None:
+        signature = self._file_signature()
+        if self._dirty or signature == self._signature:
+            return
+        with self._lock:
+            if not self._dirty and signature != self._signature:
+                self._load()
+                self._signature = signature
+
+    def _load(self) -> None:
+        if not os.path.exists(self._chunks_path):
+            return
+        ids, documents, metadatas = [], [], []
+        with open(self._chunks_path, "r", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                ids.append(record["id"])
+                documents.append(record["document"])
+                metadatas.append(record["metadata"])
+        matrix = np.load(self._embeddings_path, mmap_mode="r")
+        # 另一个进程正在替换两个文件时行数可能暂时不一致，保留已加载的数据，下次再重新加载
+        if matrix.shape[0] != len(ids):
+            return
+        norms = np.load(self._norms_path) if os.path.exists(self._norms_path) else None
+        self._matrix = matrix
+        self._norms = norms if norms is not None and norms.shape[0] == len(ids) else None
+        self._ids, self._documents, self._metadatas = ids, documents, metadatas
+        self._positions = {chunk_id: row for row, chunk_id in enumerate(ids)}
+
+    def count(self) -> int:
+        self._ensure_loaded()
+        return len(self._ids)
+
+    # 平方l2距离：|x|² - 2x·q + |q|²；没有保存的范数文件或有未flush的写入时按块重新计算范数
+    def _distances(self, query: np.ndarray) -> np.ndarray:
+        matrix, norms = self._matrix, self._norms
+        if norms is None or norms.shape[0] != matrix.shape[0]:
+            norms = self._norms = _squared_norms(matrix)
+        dots = np.concatenate([block @ query for block in _blocks(matrix)])
+        return (norms - 2.0 * dots + float(query @ query)).clip(min=0.0)
+
+    def query(self, embedding: Sequence[float], top_k: int) -> Tuple[List[str], List[str], List[float]]:
+        self._ensure_loaded()
+        if not self._ids or top_k <= 0:
+            return [], [], []
+        distances = self._distances(np.asarray(embedding, dtype=np.float32))
+        k = min(top_k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [self._ids[i] for i in top], [self._documents[i] for i in top], distances[top].tolist()
+
+    def get(self, source: Optional[str] = None, embeddings: bool = False) -> Dict[str, list]:
+        self._ensure_loaded()
+        rows = [row for row, metadata in enumerate(self._metadatas)
+                if source is None or (metadata or {}).get("source") == source]
+        result = {
+            "ids": [self._ids[row] for row in rows],
+            "documents": [self._documents[row] for row in rows],
+            "metadatas": [self._metadatas[row] for row in rows],
+        }
+        if embeddings:
+            result["embeddings"] = np.asarray(self._matrix[rows], dtype=np.float32)
+        return result
+
+    # 第一次写入时把内存映射的矩阵复制为可写的float32矩阵，调用前需持有锁；写入后范数需重新计算
+    def _make_writable(self) -> None:
+        if not self._dirty:
+            self._matrix = np.array(self._matrix, dtype=np.float32)
+            self._dirty = True
+        self._norms = None
+
+    def upsert(self, ids: List[str], documents: List[str], embeddings: List[List[float]],
+               metadatas: List[Dict]) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        self._ensure_loaded()
+        with self._lock:
+            self._make_writable()
+            if self._matrix.shape[0] == 0:
+                self._matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            new_rows = []
+            for chunk_id, document, vector, metadata in zip(ids, documents, vectors, metadatas):
+                row = self._positions.get(chunk_id)
+                if row is None:
+                    self._positions[chunk_id] = len(self._ids)
+                    self._ids.append(chunk_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                    new_rows.append(vector)
+                else:
+                    self._documents[row] = document
+                    self._metadatas[row] = metadata
+                    if row < self._matrix.shape[0]:
+                        self._matrix[row] = vector
+                    else:
+                        # 同一批中重复出现的新片段
+                        new_rows[row - self._matrix.shape[0]] = vector
+            if new_rows:
+                self._matrix = np.vstack([self._matrix, np.stack(new_rows)])
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]) -> None:
+        self._ensure_loaded()
+        with self._lock:
+            self._make_writable()
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self._positions.get(chunk_id)
+                if row is not None:
+                    self._metadatas[row] = metadata
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        self._ensure_loaded()
+        with self._lock:
+            self._make_writable()
+            removed = set(ids)
+            keep = [row for row, chunk_id in enumerate(self._ids) if chunk_id not in removed]
+            self._matrix = self._matrix[keep]
+            self._ids = [self._ids[row] for row in keep]
+            self._documents = [self._documents[row] for row in keep]
+            self._metadatas = [self._metadatas[row] for row in keep]
+            self._positions = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+
+    # 先写临时文件再替换；旁路文件最后替换，读取方以其变化为准重新加载
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            stored = self._matrix.astype(self.dtype)
+            with open(self._embeddings_path + ".tmp", "wb") as file:
+                np.save(file, stored)
+            # 范数按保存精度的向量计算，与读取时参与乘法的向量一致
+            with open(self._norms_path + ".tmp", "wb") as file:
+                np.save(file, _squared_norms(stored))
+            with open(self._chunks_path + ".tmp", "w", encoding="utf-8") as file:
+                for chunk_id, document, metadata in zip(self._ids, self._documents, self._metadatas):
+                    file.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata},
+                                          ensure_ascii=False) + "\n")
+            os.replace(self._embeddings_path + ".tmp", self._embeddings_path)
+            os.replace(self._norms_path + ".tmp", self._norms_path)
+            os.replace(self._chunks_path + ".tmp", self._chunks_path)
+            self._dirty = False
+            self._signature = None
+        self._ensure_loaded()
+
+    def max_batch_size(self) -> int:
+        return FLAT_MAX_BATCH_SIZE
+
+    def data_files(self) -> List[str]:
+        return [self._embeddings_path, self._chunks_path]
+
+
+# 按块转换为float32，避免float16矩阵整体复制
+def _blocks(matrix: np.ndarray):
+    for start in range(0, matrix.shape[0], SEARCH_BLOCK_ROWS):
+        yield matrix[start:start + SEARCH_BLOCK_ROWS].astype(np.float32)
+
+
+def _squared_norms(matrix: np.ndarray) -> np.ndarray:
+    return np.concatenate([np.einsum("ij,ij->i", block, block) for block in _blocks(matrix)]
+                          or [np.zeros(0, dtype=np.float32)])
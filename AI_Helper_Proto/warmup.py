@@ -0,0 +1,56 @@
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import tracing
+
+
+# 后台预热：按顺序在后台线程中执行各加载步骤，界面无需等待即可渲染
+# future在全部步骤完成后就绪，步骤出错时future抛出该异常；timeline记录各步骤相对预热开始的时间
+class Warmup:
+    def __init__(self, steps: Sequence[Tuple[str, Callable[[], object]]]):
+        self.steps = list(steps)
+        self.future: Future = Future()
+        self.timeline: List[Dict[str, object]] = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def start(self) -> "Warmup":
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        return self
+
+    def _elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def _run(self) -> None:
+        try:
+            with tracing.span("startup", steps=len(self.steps)):
+                for name, step in self.steps:
+                    start_ms = self._elapsed_ms()
+                    with tracing.span(f"warmup.{name}"):
+                        step()
+                    self._add(name, start_ms, self._elapsed_ms() - start_ms)
+        except Exception as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(self.timeline)
+
+    def _add(self, name: str, start_ms: float, duration_ms: float) -> None:
+        with self._lock:
+            self.timeline.append({"step": name, "start_ms": start_ms, "duration_ms": duration_ms})
+
+    # 记录一个瞬时事件，如界面首次渲染完成；同名事件只记录第一次
+    def mark(self, name: str) -> None:
+        with self._lock:
+            if any(entry["step"] == name for entry in self.timeline):
+                return
+        self._add(name, self._elapsed_ms(), 0.0)
+
+    def ready(self) -> bool:
+        return self.future.done()
+
+    # 等待预热完成，预热失败时抛出对应异常
+    def wait(self, timeout: float = None) -> List[Dict[str, object]]:
+        return self.future.result(timeout)